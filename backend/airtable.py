@@ -0,0 +1,97 @@
+import json
+import os
+import time
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from ratelimit import RateLimiter
+
+# Point AIRTABLE_API_URL at a local mock server to test the writer without touching Airtable
+AIRTABLE_API_URL = os.getenv("AIRTABLE_API_URL", "https://api.airtable.com/v0")
+# Airtable accepts at most 10 records per request and 5 requests per second per base
+BATCH_SIZE = 10
+RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", 5))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Seconds to wait for a Retry-After header, given as seconds or as an HTTP date; None if it cannot be parsed
+def retry_delay(retry_after):
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Writes records to an Airtable table in batches of 10 over a pooled session.
+# Batches are sent concurrently within the rate limit and retried with exponential backoff
+# on 429/5xx and connection errors. With upsert_fields set, records are upserted
+# (performUpsert) on those fields, so re-running an export does not create duplicates.
+class AirtableWriter:
+    def __init__(self, api_key, base_id, table_id, api_url=AIRTABLE_API_URL, max_workers=3,
+                 rate=RATE_LIMIT, max_retries=5, backoff=0.5, upsert_fields=None, timeout=30):
+        self.url = f"{api_url.rstrip('/')}/{base_id}/{table_id}"
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.upsert_fields = upsert_fields
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _payload(self, batch):
+        payload = {"records": [{"fields": fields} for fields in batch]}
+        if self.upsert_fields:
+            payload["performUpsert"] = {"fieldsToMergeOn": list(self.upsert_fields)}
+        return payload
+
+    # Send one batch, retrying transient failures. Returns None on success or a failure description.
+    def _send_batch(self, batch):
+        method = "PATCH" if self.upsert_fields else "POST"
+        data = json.dumps(self._payload(batch))
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                delay = retry_delay(error.get("retry_after")) if error else None
+                time.sleep(delay if delay is not None else self.backoff * 2 ** (attempt - 1))
+            self.rate_limiter.wait()
+            try:
+                response = self.session.request(method, self.url, data=data, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = {"status": None, "error": str(e)}
+                continue
+            except requests.RequestException as e:
+                error = {"status": None, "error": str(e)}
+                break
+            if response.status_code == 200:
+                return None
+            error = {
+                "status": response.status_code,
+                "error": response.text,
+                "retry_after": response.headers.get("Retry-After"),
+            }
+            if response.status_code not in RETRY_STATUSES:
+                break
+        return dict(error, records=batch)
+
+    # Write all records; returns {"written": count, "failed": [failure, ...]}
+    def write(self, records):
+        batches = [records[i:i + BATCH_SIZE] for i in range(0, len(records), BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._send_batch, batches))
+        failed = [result for result in results if result is not None]
+        written = sum(len(batch) for batch, result in zip(batches, results) if result is None)
+        return {"written": written, "failed": failed}
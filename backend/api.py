@@ -0,0 +1,333 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, jsonify, request
+import telemetry
+from app import run_document_pipeline, complete_questionnaire, store, fill_fields, speculate_refill
+from refill import SpeculativeRefill
+from session_store import session_key
+
+# HTTP API used by the React frontend (frontend/src/components/Chat.js).
+# Documents and questionnaire refills run as background jobs on a shared worker pool.
+# Endpoints answer synchronously by default, as the frontend expects; pass ?async=1
+# to get a job id back immediately and follow it with /api/jobs/<id> or its SSE stream.
+
+app = Flask(__name__)
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("API_WORKERS", 4)))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = float(os.getenv("API_JOB_TTL", 3600))
+# Sessions unused for this many seconds are dropped from memory (they stay in the persistent store)
+SESSION_TTL = float(os.getenv("API_SESSION_TTL", 3600))
+
+jobs = {}
+sessions = {}
+# When each session in memory was last used
+session_used = {}
+# Background refills per session, started after each answer (not persisted)
+speculations = {}
+state_lock = threading.Lock()
+
+
+class Job:
+    def __init__(self, kind, session_id):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.session_id = session_id
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.updated = time.time()
+        self.changed = threading.Condition()
+        self.future = None
+
+    def update(self, status, result=None, error=None):
+        with self.changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.updated = time.time()
+            self.changed.notify_all()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "session_id": self.session_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+# Run func(*args) as a background job on the shared pool
+def submit_job(kind, session_id, func, *args):
+    job = Job(kind, session_id)
+    now = time.time()
+    with state_lock:
+        for job_id in [job_id for job_id, old in jobs.items() if old.status in ("done", "failed") and now - old.updated > JOB_TTL]:
+            del jobs[job_id]
+        jobs[job.id] = job
+
+    def run():
+        job.update("running")
+        try:
+            with telemetry.session(session_id):
+                result = func(*args)
+        except Exception as e:
+            job.update("failed", error=str(e))
+            raise
+        job.update("done", result=result)
+        return result
+
+    job.future = executor.submit(run)
+    return job
+
+
+# Either wait for the job and return its result, or return the job id when ?async=1 is given
+def job_response(job):
+    if request.args.get("async") == "1":
+        return jsonify(job.to_dict()), 202
+    try:
+        result = job.future.result()
+    except Exception as e:
+        return jsonify(error=str(e), job_id=job.id, session_id=job.session_id), 500
+    return jsonify(dict(result, job_id=job.id, session_id=job.session_id))
+
+
+# The session id the client sent (X-Session-ID header or session_id parameter), or None
+def get_session_id():
+    data = request.get_json(silent=True) or {}
+    return (
+        request.headers.get("X-Session-ID")
+        or request.args.get("session_id")
+        or request.form.get("session_id")
+        or data.get("session_id")
+    )
+
+
+def missing_session():
+    return jsonify(error="No session id given; send the session_id returned by /api/process_document as X-Session-ID"), 400
+
+
+# Drop the sessions (and their background refills) unused for longer than SESSION_TTL and mark
+# session_id as used. Called with state_lock held.
+def touch_session(session_id):
+    now = time.time()
+    for old_id in [old_id for old_id, used in session_used.items() if now - used > SESSION_TTL and old_id != session_id]:
+        del session_used[old_id]
+        sessions.pop(old_id, None)
+        speculation = speculations.pop(old_id, None)
+        if speculation is not None:
+            speculation.clear()
+    session_used[session_id] = now
+
+
+# Sessions live in memory and in the persistent store, so they survive a restart of the API
+def get_session(session_id):
+    with state_lock:
+        session = sessions.get(session_id)
+        if session is None and store is not None:
+            session = store.get(session_key(session_id))
+            if session is not None:
+                sessions[session_id] = session
+        if session is not None:
+            touch_session(session_id)
+        return session
+
+
+def save_session(session_id, session):
+    with state_lock:
+        touch_session(session_id)
+        sessions[session_id] = session
+    if store is not None:
+        store.set(session_key(session_id), session)
+
+
+# Store the outcome of complete_questionnaire in the session and build the response for the frontend
+def apply_outcome(session_id, session, status, output, completed_json):
+    session["in_conflict_resolution"] = False
+    session["completed_json"] = completed_json
+    if status == "conflicts":
+        # The frontend shows the first conflict question itself
+        session["conflict_questions"] = output
+        session["questions"] = output
+        session["current_question_index"] = 1
+        session["in_conflict_resolution"] = True
+        session["questionnaire_complete"] = False
+        save_session(session_id, session)
+        return {"status": "conflicts_detected", "question": output[0], "questions": output}
+    session["questionnaire_complete"] = True
+    save_session(session_id, session)
+    return {"status": "complete", "executive_summary": output}
+
+
+def process_pdf(session_id, pdf_bytes):
+    result = run_document_pipeline(pdf_bytes)
+    # The extracted text is not needed after the pipeline (its checkpoint has it), so it is not kept
+    session = dict(
+        {key: value for key, value in result.items() if key != "text"},
+        answers=[],
+        conflict_questions=[],
+        # The frontend shows the first question itself
+        current_question_index=1,
+        in_conflict_resolution=False,
+        questionnaire_complete=False,
+    )
+    save_session(session_id, session)
+    return {
+        "questions": result["questions"],
+        "classification_result": result["classification_result"],
+        "stage_timings": result["stage_timings"],
+    }
+
+
+def finish_questionnaire(session_id):
+    session = get_session(session_id)
+    with state_lock:
+        speculation = speculations.pop(session_id, None)
+    status, output, completed_json = complete_questionnaire(
+        session["questions"],
+        session["conflict_questions"],
+        session["answers"],
+        session["obs"],
+        session["bizobj"],
+        session["in_conflict_resolution"],
+        previous_json=session.get("completed_json"),
+        speculation=speculation,
+    )
+    return apply_outcome(session_id, session, status, output, completed_json)
+
+
+# Refill the completed JSON with free text the user sends after the questionnaire
+def apply_additional_text(session_id, text):
+    session = get_session(session_id)
+    status, output, completed_json = complete_questionnaire(
+        ["Is there any additional information about the requirements?"],
+        [],
+        [text],
+        session["obs"],
+        session["bizobj"],
+        False,
+        base_json=session.get("completed_json"),
+    )
+    return apply_outcome(session_id, session, status, output, completed_json)
+
+
+@app.after_request
+def add_cors_headers(response):
+    response.headers["Access-Control-Allow-Origin"] = os.getenv("API_ALLOWED_ORIGIN", "*")
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-Session-ID"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    return response
+
+
+@app.route("/api/process_document", methods=["POST"])
+def process_document():
+    uploaded_file = request.files.get("file")
+    if uploaded_file is None:
+        return jsonify(error="No file uploaded"), 400
+    # Every upload without a session id starts a new session; the id is returned with the result
+    session_id = get_session_id() or uuid.uuid4().hex
+    return job_response(submit_job("process_document", session_id, process_pdf, session_id, uploaded_file.read()))
+
+
+@app.route("/api/show_question", methods=["POST"])
+def show_question():
+    data = request.get_json(silent=True) or {}
+    session_id = get_session_id()
+    if session_id is None:
+        return missing_session()
+    session = get_session(session_id)
+    if session is None:
+        return jsonify(error="Please upload a PDF document first"), 400
+    if session["questionnaire_complete"]:
+        return jsonify(status="complete", executive_summary="The questionnaire is complete. Thank you for your responses!")
+
+    if data.get("answer") is not None:
+        session["answers"].append(data["answer"])
+
+    index = session["current_question_index"]
+    if index < len(session["questions"]):
+        # Re-fill the fields of the questions answered so far while the user answers the next one
+        with state_lock:
+            speculation = speculations.setdefault(session_id, SpeculativeRefill(fill_fields))
+        with telemetry.session(session_id):
+            speculate_refill(
+                speculation,
+                session["questions"][:index],
+                session["answers"],
+                session["obs"],
+                session["bizobj"],
+                session.get("completed_json") if session["in_conflict_resolution"] else None,
+                resolve=session["in_conflict_resolution"],
+            )
+        session["current_question_index"] = index + 1
+        save_session(session_id, session)
+        return jsonify(status="question", question=session["questions"][index], session_id=session_id)
+    return job_response(submit_job("complete_questionnaire", session_id, finish_questionnaire, session_id))
+
+
+@app.route("/api/process_additional_text", methods=["POST"])
+def process_additional_text():
+    data = request.get_json(silent=True) or {}
+    session_id = get_session_id()
+    if session_id is None:
+        return missing_session()
+    if get_session(session_id) is None:
+        return jsonify(error="Please upload a PDF document first"), 400
+    if not data.get("text"):
+        return jsonify(error="No text provided"), 400
+    return job_response(submit_job("process_additional_text", session_id, apply_additional_text, session_id, data["text"]))
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(job.to_dict())
+
+
+# Server-sent events with the job state every time it changes, until the job finishes
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+
+    def stream():
+        last_status = None
+        while last_status not in ("done", "failed"):
+            with job.changed:
+                if job.status == last_status:
+                    job.changed.wait(timeout=15)
+                snapshot = job.to_dict()
+            if snapshot["status"] == last_status:
+                yield ": keep-alive\n\n"
+                continue
+            last_status = snapshot["status"]
+            yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# LLM call metrics of this process in the OpenMetrics text format, for Prometheus to scrape
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(telemetry.metrics_text(), mimetype="application/openmetrics-text; version=1.0.0; charset=utf-8")
+
+
+# Per-stage LLM calls, time, tokens and estimated cost of a session, from its trace file
+@app.route("/api/telemetry", methods=["GET"])
+def session_telemetry():
+    session_id = get_session_id()
+    if session_id is None:
+        return missing_session()
+    return jsonify(session_id=session_id, stages=telemetry.session_summary(session_id))
+
+
+if __name__ == "__main__":
+    app.run(host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", 5000)), threaded=True)
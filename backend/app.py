@@ -1,368 +1,386 @@
 import streamlit as st
-import requests
 import os
 import json
-from PyPDF2 import PdfReader
-from groq import Groq
+from pdf_extract import iter_pdf_pages, read_pdf_bytes, DocumentReadError
 from dotenv import load_dotenv
 import time
-import ast
+import uuid
+import contextvars
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import run_stages
+from llm import chat_completion, stream_completion, stage_config
+from chunking import chunked_fill, parse_json_output, CHUNK_MAX_CHARS, CHUNK_OVERLAP
+from retrieval import build_index, RETRIEVAL_MIN_CHARS, RETRIEVAL_TOP_K, PASSAGE_CHARS
+import templates
+from templates import minify, observations_for, group_observations
+from conflicts import find_conflicts
+from dedup import merge_questions, QUESTION_DEDUP, QUESTION_DEDUP_THRESHOLD, EMBEDDING_MODEL
+from refill import incremental_refill, open_fields, merge_templates, load_json, dumps, parse_field_answers, SpeculativeRefill
+from airtable import AirtableWriter
+from export import iter_rows, write_ndjson, SCHEMA_KEYS
+from structured import generate_validated, parse_question_list, parse_question_map, metrics, StructuredOutputError
+import telemetry
+import prompts
+from tokens import count_tokens, filled_template_tokens, question_tokens, session_usage, TokenLimitError
+from session_store import open_store, document_key, session_key
 
 # Load environment variables
 load_dotenv()
 
+# Persistent store for the per-stage document checkpoints and the Streamlit session state (SESSION_STORE)
+store = open_store()
+# Session state that is saved after every run and restored when the browser session comes back
+SESSION_FIELDS = (
+    "file_processed", "questionnaire_started", "current_question_index", "messages", "questions",
+    "questionnaire_complete", "conflict_questions", "initial_answers", "in_conflict_resolution",
+    "classification_result", "obs", "bizobj", "stage_timings", "completed_json", "document_key",
+)
+
 # Function to extract text from the uploaded PDF
-def extract_text_from_pdf(pdf_file):
-    text = ""
+# Pages are extracted lazily (in parallel for large documents) and joined once at the end.
+# Extraction stops after PDF_MAX_CHARS characters; per-page seconds are appended to page_timings if given.
+# Raises DocumentReadError when the PDF cannot be read or contains no text.
+def extract_text_from_pdf(pdf_file, page_timings=None):
+    max_chars = int(os.getenv("PDF_MAX_CHARS", 2000000))
+    pages = []
+    total_chars = 0
     try:
-        reader = PdfReader(pdf_file)
-        for page in reader.pages:
-            text += page.extract_text()
+        for index, page_text, seconds in iter_pdf_pages(pdf_file):
+            if page_timings is not None:
+                page_timings.append(seconds)
+            pages.append(page_text)
+            total_chars += len(page_text)
+            if total_chars >= max_chars:
+                st.warning(f"The document is too long; only the first {index + 1} pages were read.")
+                break
     except Exception as e:
-        st.error(f"An error occurred while reading the PDF: {e}")
+        raise DocumentReadError(f"An error occurred while reading the PDF: {e}") from e
+    text = "\n".join(pages)
+    if not text.strip():
+        raise DocumentReadError("The PDF contains no extractable text (is it a scanned document?)")
     return text
 
 # Function to classify the extracted text using the LLM
-def classification_LLM(text):
-
-
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful classification assistant. You understand engineering concepts. You will be given some text which mostly describes a problem. You have to classify the problem according to a list of choices. More than one choice can also be applicable. Return as a array of applicable CHOICES only. Only return the choices that you are very sure about\n\n#CHOICES\n\n2D Measurement: Diameter, thickness, etc.\n\nAnomaly Detection: Scratches, dents, corrosion\n\nPrint Defect: Smudging, misalignment\n\nCounting: Individual components, features\n\n3D Measurement: Volume, surface area\n\nPresence/Absence: Missing components, color deviations\n\nOCR: Optical Character Recognition, Font types and sizes to be recognized, Reading speed and accuracy requirements\n\nCode Reading: Types of codes to read (QR, Barcode)\n\nMismatch Detection: Specific features to compare for mismatches, Component shapes, color mismatches\n\nClassification: Categories of classes to be identified, Features defining each class\n\nAssembly Verification: Checklist of components or features to verify, Sequence of assembly to be followed\n\nColor Verification: Color standards or samples to match\n"
-            },
-            {
-                "role": "user",
-                "content": text
-            }
-        ],
+def classification_LLM(text, index=None):
+    # Long documents are classified from the passages most related to the choices
+    if index is not None:
+        text = index.context(prompts.CLASSIFICATION)
+
+    answer = chat_completion(
+        "classification",
+        messages=prompts.messages(prompts.CLASSIFICATION, text),
         temperature=0.21,
         max_tokens=2048,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=len(templates.CLASSIFICATION_CHOICES) * 10,
     )
 
-    answer = ""
-    for chunk in completion:
-        answer += chunk.choices[0].delta.content or ""
     return answer
 
-def obsjsoncreate(json_template,text,ogtext):
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful assistant. You will be given a text snippet. You will also be given a JSON where some of the fields match with the bullet points in the text. I want you return a JSON where only the fields and subproperties mentioned in the text are present. DONT OUTPUT ANYTHING OTHER THAN THE JSON\n"
-            },
-            {
-                "role": "user",
-                "content": "JSON:"+str(json_template)+"\nText:"+text
-            }
-        ],
-        temperature=0.21,
-        max_tokens=8000,
-        top_p=1,
-        stream=True,
-        stop=None,
-    )
-    cutjson=""
-    for chunk in completion:
-        cutjson += chunk.choices[0].delta.content or ""
-    
-    completion2 = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a sophisticated classification assistant with expertise in engineering concepts. Your task is to populate a JSON structure based on information provided in a PDF document and subsequent user responses. Follow these guidelines carefully:\n\n1. JSON Structure:\n You will be given a JSON template with properties and their descriptions.\nYour goal is to fill the \"User Answer\" subproperty for each field based on the information provided.\n\n2. Information Sources:\nPrimary source: Details extracted from the PDF document.\n\n3. Filling the \"User Answer\":\nIf a clear, unambiguous answer is found, fill it in the \"User Answer\" field.\nIf no information is available or the answer is unclear, mark the field as 'TBD' (To Be Determined).\n\n4. Handling Conflicts:\nMark a field as 'CONFLICT' in the following scenarios:\na: Multiple occurrences of the same field in the PDF with different answers.\nb: Multiple, inconsistent answers provided by the user for the same field.\n\n5. Accuracy and Relevance:\nEnsure that the answers are relevant to the field descriptions.\nDo not infer or assume information that is not explicitly stated.\n\n6. Output Format:\nProvide only the valid, properly formatted JSON as output.\nGive the JSON output with the filled fields only.\nEnsure proper nesting, quotation marks, and commas in the JSON structure.\n\n7. Additional Notes:\nPay attention to units of measurement and formats specified in the field descriptions.\nIf a field requires a specific format (e.g., date, number range), ensure the answer adheres to it.\n\nRemember, your role is to accurately capture and classify the information provided, highlighting any inconsistencies or conflicts. Do not output anything other than the requested JSON structure. Your goal is to provide a clear, accurate, and properly formatted JSON output that reflects the information given, including any ambiguities or conflicts encountered.Give the JSON output with the filled fields only. ENSURE THE JSON IS VALID AND PROPERLY FORMATTED. DO NOT OUTPUT ANYTHING OTHER THAN THE JSON."
-            },
-            {
-                "role": "user",
-                "content": "JSON: "+cutjson+"\n Text: "+ogtext
-            }
-        ],
+# Ask the LLM to cut observationsJSON down to the fields mentioned in the classification
+def obs_cut(json_template,text):
+    return chat_completion(
+        "obs_cut",
+        messages=prompts.messages(prompts.OBS_CUT, text, prefix="JSON:"+minify(json_template)+"\nText:"),
         temperature=0.21,
         max_tokens=8000,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=filled_template_tokens(json_template),
     )
-    answer = ""
-    for chunk in completion2:
-        answer += chunk.choices[0].delta.content or ""
-    return answer
 
-def bizobjjsoncreate(json_template,text):
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    completion2 = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful classification assistant. You understand engineering concepts. You will be given a JSON where there are properties and their descriptions. You need to fill up the JSON subproperty \"User Answer\" from the details given in the text. If no information is available or the answer is unclear or you are not sure, mark the field as 'TBD' (To Be Determined) and mark a field as 'CONFLICT' in the following scenarios:\na: Multiple occurrences of the same field in the PDF with different answers.\nb: Multiple, inconsistent answers provided by the user for the same field.\n\n Give the JSON output with the filled fields only. ENSURE THE JSON IS VALID AND PROPERLY FORMATTED. DO NOT OUTPUT ANYTHING OTHER THAN THE JSON."
-            },
-            {
-                "role": "user",
-                "content": "JSON: "+str(json_template)+"\n Text: "+text
-            }
-        ],
-        temperature=0.21,
-        max_tokens=8000,
-        top_p=1,
-        stream=True,
-        stop=None,
-    )
-    answer = ""
-    for chunk in completion2:
-        answer += chunk.choices[0].delta.content or ""
-    return answer
-
-def question_create(json_template):
-
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a sophisticated classification assistant with expertise in engineering concepts. You will be given a JSON where some subproperties labelled \"User Answer\" are marked as \"TBD\”. I want you to create questions that you as an assistant would ask the user in order to fill up the User Answer field. Create questions to fill these fields, considering the following:\n\n1. For 'TBD' fields, ask for the missing information.\n2. Ensure questions are relevant to the field descriptions.\n3. Pay attention to required formats or units of measurement.\n4. Avoid asking about information already present in the JSON.\n\nReturn all the questions for the user in an array. DO NOT OUTPUT ANYTHING OTHER THAN THE QUESTION ARRAY." 
-            },
-            {
-                "role": "user",
-                "content": str(json_template)
-            }
-        ],
+# Observation fill modes (OBS_FILL_MODE):
+#   single        the observations of the classification are selected locally and filled in one pass (default)
+#   per_category  as single, but every observation type is filled by its own call, in parallel
+#   two_pass      the previous path: an LLM "cut" pass selects the observations, a second pass fills them
+OBS_FILL_MODES = ("single", "per_category", "two_pass")
+
+def obsjsoncreate(json_template,text,ogtext,index=None,mode=None):
+    mode = mode or os.getenv("OBS_FILL_MODE", "single")
+    # The observations for each classification choice are precomputed, so the LLM "cut"
+    # pass is only needed when the classification names none of the known choices
+    cutjson = observations_for(text) if mode != "two_pass" else None
+    if not cutjson:
+        cutjson = obs_cut(json_template, text)
+
+    # Fill the cut JSON from the text; long documents are filled chunk by chunk and merged
+    def fill(cut_template, text_chunk):
+        return chat_completion(
+            "obs_fill",
+            messages=prompts.messages(prompts.OBS_FILL, text_chunk, prefix="JSON: "+minify(cut_template)+"\n Text: "),
+            temperature=0.21,
+            max_tokens=8000,
+            expected_tokens=filled_template_tokens(cut_template),
+        )
+
+    # Fill every observation type with its own, smaller call and concatenate the results in template order
+    if mode == "per_category" and isinstance(cutjson, list):
+        groups = group_observations(cutjson)
+        with ThreadPoolExecutor(max_workers=max(len(groups), 1)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, chunked_fill, fill, group, ogtext, index=index) for group in groups]
+            outputs = [future.result() for future in futures]
+        filled = []
+        for group, output in zip(groups, outputs):
+            try:
+                result = parse_json_output(output)
+            except json.JSONDecodeError:
+                result = None
+            if not isinstance(result, list):
+                print(f"Keeping the unfilled {group[0]['Observation Type']} observations: the fill is not a JSON array")
+                result = group
+            filled.extend(result)
+        return json.dumps(filled, indent=2)
+
+    return chunked_fill(fill, cutjson, ogtext, index=index)
+
+def bizobjjsoncreate(json_template,text,index=None):
+    # Long documents and schemas are split into batches that are filled in parallel and merged
+    def fill(template_part, text_chunk):
+        return chat_completion(
+            "bizobj_fill",
+            messages=prompts.messages(prompts.BIZOBJ_FILL, text_chunk, prefix="JSON: "+minify(template_part)+"\n Text: "),
+            temperature=0.21,
+            max_tokens=8000,
+            expected_tokens=filled_template_tokens(template_part),
+        )
+
+    return chunked_fill(fill, json_template, text, index=index)
+
+def question_create(json_template, refresh=False):
+
+    answer = chat_completion(
+        "question_create",
+        messages=prompts.messages(prompts.QUESTION_CREATE, str(json_template)),
         temperature=0.21,
         max_tokens=2048,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=question_tokens(json_template),
+        refresh=refresh,
     )
+    # With QUESTION_DEDUP the merged lists are deduplicated locally instead of by the refine call
+    if QUESTION_DEDUP:
+        return answer
 
-    answer = ""
-    for chunk in completion:
-        answer += chunk.choices[0].delta.content or ""
-
-
-    client = Groq()
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an experienced writer tasked with refining a set of questions. Follow these guidelines:\n\n1. Ignore any questions about uploading images.\n2. Merge questions asking about different aspects of the same topic.\n3. Maintain a professional yet slightly humorous tone.\n4. Ensure questions are clear and concise.\n5. Avoid redundancy and limit the output to a maximum of 15 questions.\n6. Format the questions to elicit precise answers that can be used in a JSON structure.\n\nRETURN AN ARRAY OF THE REFINED QUESTIONS ONLY. DO NOT RETURN ANYTHING ELSE."
-            },
-            {
-                "role": "user",
-                "content": answer
-            }
-        ],
+    final = chat_completion(
+        "question_refine",
+        messages=prompts.messages(prompts.QUESTION_REFINE, answer),
         temperature=0.73,
         max_tokens=2240,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=count_tokens(answer),
+        refresh=refresh,
     )
-    final=""
-    for chunk in completion:
-        final+=chunk.choices[0].delta.content or ""
 
     return final
 
 def answer_refill(questions,answers,obs_json_template,bizobj_json_template):
 
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful assistant. You will be given two arrays: questions and answers. Create a question-answer pair array. For example:\n\n#INPUT\nQuestions=['What is the material of the observed object?', 'What are the dimensions of the object?']\nAnswers=['The object appears to be made of stainless steel', '10 cm x 5 cm x 2 cm']\n\n#OUTPUT\n['Question: What is the material of the observed object? Answer: The object appears to be made of stainless steel','Question: What are the dimensions of the object? Answer: 10 cm x 5 cm x 2 cm']. RETURN ONLY THE FINAL ARRAY OF QUESTION-ANSWER PAIRS."
-            },
-            {
-                "role": "user",
-                "content": "Question="+str(questions)+"\nAnswer="+str(answers)
-            }
-        ],
+    qapair = chat_completion(
+        "qa_pair",
+        messages=prompts.messages(prompts.QA_PAIR, "Question="+str(questions)+"\nAnswer="+str(answers)),
         temperature=0.5,
         max_tokens=4048,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=count_tokens(str(questions) + str(answers)),
     )
 
-    qapair = ""
-    for chunk in completion:
-        qapair += chunk.choices[0].delta.content or ""
     # print(qapair)
     # print(obs_json_template+bizobj_json_template)
     # print("Question Answer:"+str(qapair)+"\nJSON:\n"+str(obs_json_template+bizobj_json_template))
-    completion2 = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a sophisticated classification assistant with expertise in engineering concepts. You will be given a question-answer pair array and a two JSON templates. Follow these guidelines:\n\n1. Fill the \"User Answer\" subproperties in the JSONs based on the question-answer pairs.\n\n2. For fields still marked as \"TBD\" after filling, keep them as \"TBD\".\n\n3. If multiple answers conflict for the same field or there is an answer for an already filled field except \"TBD\", mark its  \"User Answer\" subproperty as \"CONFLICT\"\n\n4. Ensure answers are relevant to field descriptions and adhere to specified formats or units.\n\n5. Do not infer or assume information until not explicitly stated.\n\n6. After filling, merge the two JSONs into a single JSON structure and make sure that there is NO RACE CONDITION while merging.Make sure you return the full JSON, without missing any field. \n\n7. Return the complete, filled, and merged JSON.\n\n8. Ensure the final JSON is valid and properly formatted. DO NOT OUTPUT ANYTHING OTHER THAN THE FINAL MERGED JSON."
-            },
-            {
-                "role": "user",
-                "content": "Question Answer:"+str(qapair)+"\nJSON:\n"+str(obs_json_template+bizobj_json_template)
-            }
-        ],
+    filled_json = chat_completion(
+        "answer_refill",
+        messages=prompts.messages(prompts.ANSWER_REFILL, "Question Answer:"+str(qapair), prefix="JSON:\n"+str(obs_json_template+bizobj_json_template)+"\n"),
         temperature=1,
         max_tokens=8000,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=filled_template_tokens(obs_json_template) + filled_template_tokens(bizobj_json_template),
     )
-    filled_json=""
-    for chunk in completion2:
-        filled_json+=chunk.choices[0].delta.content or ""
     # print(filled_json)
     return filled_json
 
 
-def question_create_conflict(json_template):
-
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a sophisticated classification assistant with expertise in engineering concepts. You will be given a JSON where some subproperties labelled \"User Answer\" are marked as \”CONFLICT\”. I want you to create questions that you as an assistant would ask the user in order to fill up the User Answer field. Create questions to fill these fields, considering the following:\n\n1. For ‘CONFLICT’ fields, ask for the correct and precise information.\n2. Ensure questions are relevant to the field descriptions.\n3. Pay attention to required formats or units of measurement.\n4. Avoid asking about information already present in the JSON.\n\nReturn all the questions for the user in an array. DO NOT OUTPUT ANYTHING OTHER THAN THE QUESTION ARRAY."
-            },
-            {
-                "role": "user",
-                "content": str(json_template)
-            }
-        ],
+# Re-fill a few fields from one question-answer pair. Returns JSON mapping the path of each field it fills to its User Answer.
+def answer_fill_fields(question, answer, fields, refresh=False):
+    return chat_completion(
+        "answer_refill_fields",
+        messages=prompts.messages(prompts.ANSWER_REFILL_FIELDS, "Question: "+question+"\nAnswer: "+answer+"\nFields:\n"+minify(fields)),
         temperature=0.21,
-        max_tokens=2048,
-        top_p=1,
-        stream=True,
-        stop=None,
+        max_tokens=1024,
+        expected_tokens=filled_template_tokens(fields),
+        refresh=refresh,
     )
 
-    answer = ""
-    for chunk in completion:
-        answer += chunk.choices[0].delta.content or ""
-
-
-    client = Groq()
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an experienced writer tasked with refining a set of questions. Follow these guidelines:\n\n1. Ignore any questions about uploading images.\n2. Merge questions asking about different aspects of the same topic.\n3. Maintain a professional yet slightly humorous tone.\n4. Ensure questions are clear and concise.\n5. Avoid redundancy and limit the output to a maximum of 15 questions.\n6. Format the questions to elicit precise answers that can be used in a JSON structure.\n\nRETURN AN ARRAY OF THE REFINED QUESTIONS ONLY. DO NOT RETURN ANYTHING ELSE."
-            },
-            {
-                "role": "user",
-                "content": answer
-            }
-        ],
-        temperature=0.73,
-        max_tokens=2240,
-        top_p=1,
-        stream=True,
-        stop=None,
+# Validated field fill; a field that cannot be filled keeps its current answer
+def fill_fields(question, answer, fields):
+    try:
+        return generate_validated(
+            "answer_refill_fields",
+            lambda attempt: answer_fill_fields(question, answer, fields, refresh=attempt > 0),
+            lambda output: parse_field_answers(output, fields),
+        )
+    except StructuredOutputError as e:
+        print(f"Could not re-fill {list(fields)}: {e}")
+        return {}
+
+# The JSON the incremental refill patches and the markers of its open fields.
+# In conflict resolution (resolve=True) the CONFLICT fields of the previous result are patched,
+# otherwise the open fields of the previous result (follow-up answers) or of the merged templates.
+def refill_data(obs_json_template, bizobj_json_template, previous_json=None, resolve=False):
+    if resolve:
+        return load_json(previous_json), ("CONFLICT",)
+    if previous_json:
+        return load_json(previous_json), ("TBD", "")
+    return merge_templates(load_json(obs_json_template), load_json(bizobj_json_template)), ("TBD", "")
+
+# Incremental refill: only the fields each answer touches are re-filled and patched into the JSON.
+# With a SpeculativeRefill, the fills already started in the background while the user was answering are reused.
+# Returns None when the templates cannot be parsed or have no open fields, so the caller can fall back to the full refill.
+def answer_refill_incremental(questions,answers,obs_json_template,bizobj_json_template,previous_json=None,resolve=False,speculation=None):
+    try:
+        data, markers = refill_data(obs_json_template, bizobj_json_template, previous_json, resolve)
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Falling back to the full refill: {e}")
+        return None
+    if not open_fields(data, markers):
+        print("Falling back to the full refill: no open fields found")
+        return None
+    fill = speculation.fill if speculation is not None else fill_fields
+    targets = conflict_targets(data, questions) if resolve else None
+    return dumps(incremental_refill(questions, answers, data, fill, markers, resolve, targets=targets))
+
+# The conflict questions are created one per conflict in the order find_conflicts returns them,
+# so the i-th question asks for the i-th conflict field of the JSON that had the conflicts.
+# Returns None when the questions cannot be the conflict questions of data.
+def conflict_targets(data, questions):
+    pointers = list(find_conflicts(data))
+    if len(questions) > len(pointers):
+        return None
+    return pointers[:len(questions)]
+
+# Start re-filling the fields of the answers given so far in the background, so that only the
+# last answers are left to fill when the questionnaire ends. Takes the same arguments as the final refill.
+def speculate_refill(speculation, questions, answers, obs_json_template, bizobj_json_template, previous_json=None, resolve=False):
+    if os.getenv("REFILL_MODE", "incremental") != "incremental" or os.getenv("SPECULATIVE_REFILL", "1") == "0":
+        return
+    try:
+        data, markers = refill_data(obs_json_template, bizobj_json_template, previous_json, resolve)
+    except (json.JSONDecodeError, ValueError):
+        return
+    speculation.update(questions, answers, data, markers, conflict_targets(data, questions) if resolve else None)
+
+
+# One question per conflict, as a JSON object keyed by the field pointers of the conflicts JSON.
+# The questions are not refined (merged), so each one stays tied to the field it asks for.
+def question_create_conflict(json_template, refresh=False):
+
+    answer = chat_completion(
+        "question_create_conflict",
+        messages=prompts.messages(prompts.QUESTION_CREATE_CONFLICT, str(json_template)),
+        temperature=0.21,
+        max_tokens=2048,
+        expected_tokens=question_tokens(json_template),
+        refresh=refresh,
     )
-    final=""
-    for chunk in completion:
-        final+=chunk.choices[0].delta.content or ""
 
-    return final
+    return answer
 
 def answer_refill_conflict(questions,answers,obs_json_template,bizobj_json_template):
 
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful assistant. You will be given two arrays: questions and answers. Create a question-answer pair array. For example:\n\n#INPUT\nQuestions=['What is the material of the observed object?', 'What are the dimensions of the object?']\nAnswers=['The object appears to be made of stainless steel', '10 cm x 5 cm x 2 cm']\n\n#OUTPUT\n['Question: What is the material of the observed object? Answer: The object appears to be made of stainless steel','Question: What are the dimensions of the object? Answer: 10 cm x 5 cm x 2 cm']. RETURN ONLY THE FINAL ARRAY OF QUESTION-ANSWER PAIRS."
-            },
-            {
-                "role": "user",
-                "content": "Question="+str(questions)+"\nAnswer="+str(answers)
-            }
-        ],
+    qapair = chat_completion(
+        "qa_pair_conflict",
+        messages=prompts.messages(prompts.QA_PAIR, "Question="+str(questions)+"\nAnswer="+str(answers)),
         temperature=0.5,
         max_tokens=4048,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=count_tokens(str(questions) + str(answers)),
     )
 
-    qapair = ""
-    for chunk in completion:
-        qapair += chunk.choices[0].delta.content or ""
     # print(qapair)
     # print(obs_json_template+bizobj_json_template)
     # print("Question Answer:"+str(qapair)+"\nJSON:\n"+str(obs_json_template+bizobj_json_template))
-    completion2 = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a sophisticated classification assistant with expertise in engineering concepts. You will be given a question-answer pair array and a two JSON templates. Follow these guidelines:\n\n1. Fill the \"User Answer\" subproperties in the JSONs marked as \"CONFLICT\" based on the question-answer pairs.\n\n2. Ensure answers are relevant to field descriptions and adhere to specified formats or units.\n\n3. Do not infer or assume information until not explicitly stated.\n\n4. After filling, merge the two JSONs into a single JSON structure and make sure that there is NO RACE CONDITION while merging.Make sure you return the full JSON, without missing any field. \n\n5. Return the complete, filled, and merged JSON.\n\n6. Ensure the final JSON is valid and properly formatted. DO NOT OUTPUT ANYTHING OTHER THAN THE FINAL MERGED JSON."
-            },
-            {
-                "role": "user",
-                "content": "Question Answer:"+str(qapair)+"\nJSON:\n"+str(obs_json_template+bizobj_json_template)
-            }
-        ],
+    filled_json = chat_completion(
+        "answer_refill_conflict",
+        messages=prompts.messages(prompts.ANSWER_REFILL_CONFLICT, "Question Answer:"+str(qapair), prefix="JSON:\n"+str(obs_json_template+bizobj_json_template)+"\n"),
         temperature=1,
         max_tokens=8000,
-        top_p=1,
-        stream=True,
-        stop=None,
+        expected_tokens=filled_template_tokens(obs_json_template) + filled_template_tokens(bizobj_json_template),
     )
-    filled_json=""
-    for chunk in completion2:
-        filled_json+=chunk.choices[0].delta.content or ""
     # print(filled_json)
     return filled_json
 
 
-def executive_summary(json_template):
+# Summary modes (SUMMARY_MODE):
+#   sectioned  one call per top-level section of the filled JSON, run in parallel (default)
+#   single     the whole JSON in one call
+SUMMARY_MODES = ("sectioned", "single")
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", 4))
+
+# Stream the executive summary as it is generated, so it can be rendered incrementally
+def executive_summary_stream(json_template, mode=None):
+    mode = mode or os.getenv("SUMMARY_MODE", "sectioned")
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"Unknown SUMMARY_MODE {mode!r}, expected one of {SUMMARY_MODES}")
+    sections = summary_sections(json_template) if mode == "sectioned" else None
+    if not sections:
+        return stream_completion(
+            "executive_summary",
+            messages=prompts.messages(prompts.EXECUTIVE_SUMMARY, str(json_template)),
+            temperature=0.73,
+            max_tokens=5610,
+        )
+    return sectioned_summary_stream(sections)
+
+# The top-level sections of a filled JSON in schema order (BIZ_OBJ, ..., Solution, then the observations),
+# or None when the JSON cannot be parsed or has a single section
+def summary_sections(json_template):
+    try:
+        data = load_json(json_template)
+    except (json.JSONDecodeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    sections = []
+    for key, value in data.items():
+        if key == "properties" and isinstance(value, dict):
+            sections.extend(value.items())
+        elif key not in SCHEMA_KEYS:
+            sections.append((key, value))
+    sections = [(name, section) for name, section in sections if section]
+    return sections if len(sections) > 1 else None
+
+def summary_section_stream(name, section):
+    return stream_completion(
+        "executive_summary_section",
+        messages=prompts.messages(prompts.EXECUTIVE_SUMMARY_SECTION, minify(section), prefix="Section: "+name+"\nJSON: "),
+        temperature=0.73,
+        max_tokens=2048,
+    )
 
+# Summarize every section concurrently and stream them in schema order under a "## <section>" header.
+# The section being shown streams token by token; later sections are buffered until it is done,
+# so they usually appear at once.
+def sectioned_summary_stream(sections):
+    pieces = [queue.Queue() for _ in sections]
 
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    def summarize(name, section, output):
+        try:
+            for piece in summary_section_stream(name, section):
+                output.put(piece)
+            output.put(None)
+        except Exception as e:
+            output.put(e)
+
+    with ThreadPoolExecutor(max_workers=SUMMARY_WORKERS) as executor:
+        for (name, section), output in zip(sections, pieces):
+            executor.submit(contextvars.copy_context().run, summarize, name, section, output)
+        yield "# Executive Summary\n\n"
+        for (name, _), output in zip(sections, pieces):
+            yield f"## {name}\n\n"
+            while (piece := output.get()) is not None:
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+            yield "\n\n"
 
+def executive_summary(json_template):
     # Placeholder for writing the summary status
     status_text = st.empty()
     status_text.text("Writing the summary...")
 
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a professional copyrighter. You will be given a JSON, I want you to create a complete executive summary with headers and subheaders. It should be a structured document. \"User Answer\" are what are the answers you have to focus on. Dont skip any of the Fields in both JSONs. Use the Description to frame the User answer. DONT OUTPUT ANYTHING OTHER THAN THE SUMMARY."
-            },
-            {
-                "role": "user",
-                "content": str(json_template)
-            }
-        ],
-        temperature=0.73,
-        max_tokens=5610,
-        top_p=1,
-        stream=True,
-        stop=None,
-    )
-    final_summ=""
-    for chunk in completion:
-        final_summ+=chunk.choices[0].delta.content or ""
+    final_summ = "".join(executive_summary_stream(json_template))
     status_text.text("Summary generation complete!")
 
     return final_summ
@@ -378,78 +396,37 @@ def chunk_data(data, chunk_size=10):
     
     return [dict(items[i:i + chunk_size]) for i in range(0, len(items), chunk_size)]
 
-def airtable_write(json_template):
-
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-    # Groq inference
-    completion = client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[
-            {
-                "role": "system",
-                "content":  "You are a helpful assistant. You will be given a unstructured JSON. I want you to convert it into a fully structured JSON which will become a structured CSV. The headings of the CSV are to be \\\"Category\\\",\\\"Sub-category\\\",\\\"Description\\\" and \\\"User Answer\\\". So shuffle around the fields accordingly. \nFields marked \"Category\" are to be directly picked as the \"Category\" for the CSV. If there is \"Observation type\", then that becomes the Category.  \nDONT LEAVE ANY FIELD. MAKE SURE ALL FIELDS ARE INCLUDED IN THE RESULT. DONT OUTPUT ANYTHING OTHER THAN THE JSON. ONLY OUTPUT THE JSON.\n"
-            },
-            {
-                "role": "user",
-                "content": json_template
-            }
-        ],
-        temperature=0.25,
-        max_tokens=8000,
-        top_p=1,
-        stream=True,
-        # response_format={"type": "json_object"},
-        stop=None,
+def airtable_write(json_template, follow_up=False):
+
+    # Flatten the filled JSON into Category/Sub-category/Description/User Answer rows locally
+    try:
+        rows = list(iter_rows(load_json(json_template)))
+    except (json.JSONDecodeError, ValueError):
+        st.error("The completed JSON is invalid.")
+        return None
+    write_ndjson(rows, "airtable_rows.ndjson")
+    # Upsert on AIRTABLE_UPSERT_FIELDS (e.g. "Category,Sub-category") so re-exports stay idempotent
+    upsert_fields = [field.strip() for field in os.getenv("AIRTABLE_UPSERT_FIELDS", "").split(",") if field.strip()]
+    if follow_up and not upsert_fields:
+        # Posting the rows again would duplicate the records of the first export
+        print("Skipping the Airtable export of the follow-up; set AIRTABLE_UPSERT_FIELDS to update the records")
+        return None
+    writer = AirtableWriter(
+        api_key=os.getenv("AIRTABLE_KEY"),
+        base_id=os.getenv("AIRTABLE_BASE_ID", "appGIi65aZ2YxQrmH"),
+        table_id=os.getenv("AIRTABLE_TABLE_ID", "Table1"),
+        upsert_fields=upsert_fields or None,
     )
-    content=""
-    for chunk in completion:
-        content+=chunk.choices[0].delta.content or ""
-    # Get the structured JSON from Groq
-    groq_json = json.loads(content)
-    with open("groq_json.json", "w") as file:
-        json.dump(groq_json, file, indent=4)
-    API_KEY = os.getenv("AIRTABLE_KEY")
-    BASE_ID = "appGIi65aZ2YxQrmH"
-    TABLE_ID = "Table1"
-    url = f'https://api.airtable.com/v0/{BASE_ID}/{TABLE_ID}'
-
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
+    result = writer.write(rows)
+    print(f"{result['written']} records written to Airtable, {len(result['failed'])} batches failed")
 
-    # Chunk the data into batches of 10
-    def chunk_data(data, chunk_size=10):
-        for i in range(0, len(data), chunk_size):
-            yield data[i:i + chunk_size]
-
-    # Process each chunk and send it to Airtable
-    for batch in chunk_data(groq_json):
-        # Format the current batch for Airtable API
-        airtable_data = {
-            "records": [
-                {
-                    "fields": {
-                        "Category": item["Category"],
-                        "Sub-category": item["Sub-category"],
-                        "Description": item["Description"],
-                        "User Answer": item["User Answer"]
-                    }
-                } for item in batch
-            ]
-        }
-        
-        # Make the POST request to add records
-        response = requests.post(url, headers=headers, data=json.dumps(airtable_data))
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            print(f"Batch of {len(batch)} records added successfully!")
-        else:
-            print(f"Failed to add batch. Status code: {response.status_code}, Error: {response.text}")
+    # Keep failed batches on disk so they can be replayed instead of being lost
+    if result["failed"]:
+        with open("airtable_failed.json", "w") as file:
+            json.dump(result["failed"], file, indent=4)
+        st.error(f"{len(result['failed'])} batches could not be written to Airtable; they were saved to airtable_failed.json.")
+    return result
 
-            
 def main():
     st.title("Qualitas Sales Data Collection Chatbot")
     st.caption("Welcome to the Qualitas Bot. First upload a PDF document which should be customer correspondence, detailing some requirements. Also sometimes the Submit button for the questions is a bit sticky. So You might have to click it twice!")
@@ -457,6 +434,16 @@ def main():
     # Initialize session state variables
     init_session_state()
 
+    # Attribute the LLM calls of this run to the browser session in the telemetry traces,
+    # and save the session afterwards, also when Streamlit interrupts the run
+    try:
+        with telemetry.session(st.session_state.session_id):
+            run_app()
+    finally:
+        save_session()
+
+# The upload, questionnaire and chat flow of one Streamlit run
+def run_app():
     # File uploader for the PDF
     uploaded_file = st.file_uploader("Upload a PDF document", type="pdf")
     if uploaded_file is not None and not st.session_state.file_processed:
@@ -487,95 +474,148 @@ def init_session_state():
         st.session_state.initial_answers = []
     if "in_conflict_resolution" not in st.session_state:
         st.session_state.in_conflict_resolution = False
+    if "session_id" not in st.session_state:
+        # The session id is kept in the URL so a browser refresh comes back to the same session
+        st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+        st.query_params["session"] = st.session_state.session_id
+        saved = store.get(session_key(st.session_state.session_id)) if store is not None else None
+        for key, value in (saved or {}).items():
+            st.session_state[key] = value
+
+def save_session():
+    if store is None or "session_id" not in st.session_state:
+        return
+    state = {key: st.session_state[key] for key in SESSION_FIELDS if key in st.session_state}
+    store.set(session_key(st.session_state.session_id), state)
     
 
+# Generate the question list for a filled JSON, regenerating only this call if the output is not a valid array
+def questions_for(json_template):
+    return generate_validated(
+        "question_create",
+        lambda attempt: question_create(json_template, refresh=attempt > 0),
+        parse_question_list,
+    )
+
+# Build the LLM stages for a document as a dependency DAG.
+# The BizObj branch does not depend on the classification/observation branch,
+# and the two question_create calls do not depend on each other.
+# The two question lists are merged locally (without near-duplicates when QUESTION_DEDUP=1).
+def document_stages(text, obs_json_template, bizobj_json_template, index=None):
+    return {
+        "classification": (lambda: classification_LLM(text, index), []),
+        "obs": (lambda classification: obsjsoncreate(obs_json_template, classification, text, index), ["classification"]),
+        "bizobj": (lambda: bizobjjsoncreate(bizobj_json_template, text, index), []),
+        "question_obs": (questions_for, ["obs"]),
+        "question_bizobj": (questions_for, ["bizobj"]),
+        "questions": (merge_questions, ["question_bizobj", "question_obs"]),
+    }
+
+# The LLM stages the document pipeline calls
+DOCUMENT_LLM_STAGES = ("classification", "obs_cut", "obs_fill", "bizobj_fill", "question_create", "question_refine")
+
+# Everything besides the PDF and the templates that changes the document pipeline's results:
+# the effective model and backend of every stage, the prompts and the fill, retrieval, chunking
+# and dedup settings. It is part of the checkpoint key, so changing any of them re-runs the stages
+# (unchanged LLM calls are still answered by the completion cache).
+def pipeline_config():
+    stages = {stage: stage_config(stage) for stage in DOCUMENT_LLM_STAGES}
+    return {
+        "stages": {stage: [config["model"], config["backend"]] for stage, config in stages.items()},
+        "prompts": [prompts.CLASSIFICATION, prompts.OBS_CUT, prompts.OBS_FILL, prompts.BIZOBJ_FILL, prompts.QUESTION_CREATE, prompts.QUESTION_REFINE],
+        "obs_fill_mode": os.getenv("OBS_FILL_MODE", "single"),
+        "question_dedup": [QUESTION_DEDUP, QUESTION_DEDUP_THRESHOLD, EMBEDDING_MODEL],
+        "retrieval": [RETRIEVAL_MIN_CHARS, RETRIEVAL_TOP_K, PASSAGE_CHARS],
+        "chunking": [CHUNK_MAX_CHARS, CHUNK_OVERLAP],
+        "pdf_max_chars": int(os.getenv("PDF_MAX_CHARS", 2000000)),
+    }
+
+# Run the whole document pipeline without touching the Streamlit session.
+# Returns the session fields (text, classification_result, obs, bizobj, questions, stage_timings, document_key).
+# The extracted text and every stage result are checkpointed in the store under the document hash
+# (plus the templates and the pipeline configuration), so a rerun of the same document resumes after the last finished stage.
+def run_document_pipeline(pdf_file, store=store):
+    pdf_bytes = read_pdf_bytes(pdf_file)
+    # The templates are loaded and validated once at startup by the templates module
+    obs_json_template = templates.obs_template
+    bizobj_json_template = templates.bizobj_template
+    doc_key = document_key(pdf_bytes, templates.obs_template_json, templates.bizobj_template_json, json.dumps(pipeline_config(), sort_keys=True))
+    checkpoint = (store.get(doc_key) if store is not None else None) or {}
+
+    page_timings = []
+    extract_start = time.perf_counter()
+    text = checkpoint.get("text")
+    if text is None:
+        # Unreadable documents fail here, before any LLM stage runs or is checkpointed
+        text = extract_text_from_pdf(pdf_bytes, page_timings)
+        if store is not None:
+            checkpoint["text"] = text
+            store.set(doc_key, checkpoint)
+    extract_seconds = time.perf_counter() - extract_start
+
+    # Build the retrieval index once so each stage only sends the passages it needs
+    index_start = time.perf_counter()
+    index = build_index(text)
+    index_seconds = time.perf_counter() - index_start
+
+    def save_stage(name, result):
+        if store is not None:
+            checkpoint[name] = result
+            store.set(doc_key, checkpoint)
+
+    # Run the independent LLM stages concurrently unless PIPELINE_PARALLEL=0
+    parallel = os.getenv("PIPELINE_PARALLEL", "1") != "0"
+    stages = document_stages(text, obs_json_template, bizobj_json_template, index)
+    restored = {name: checkpoint[name] for name in stages if name in checkpoint}
+    results, timings = run_stages(stages, parallel=parallel, results=restored, on_result=save_stage)
+    timings["extract"] = extract_seconds
+    timings["extract_pages"] = page_timings
+    timings["index"] = index_seconds
+    timings["restored"] = sorted(restored)
+    return {
+        "text": text,
+        "classification_result": results["classification"],
+        "obs": results["obs"],
+        "bizobj": results["bizobj"],
+        "questions": results["questions"],
+        "stage_timings": timings,
+        "document_key": doc_key,
+    }
+
 def process_document(uploaded_file):
-    # Simulate file processing (replace with actual logic)
-    st.session_state.text = extract_text_from_pdf(uploaded_file)
-    st.session_state.classification_result = classification_LLM(st.session_state.text)
-    json_path='observationsJSON.json'
-    with open(json_path, 'r') as file:
-        obs_json_template = json.load(file)
-    final_obs_json = obsjsoncreate(obs_json_template, st.session_state.classification_result, st.session_state.text)
-    st.session_state.obs = final_obs_json
-    json_path='BizObjJSON.json'
-    with open(json_path, 'r') as file:
-        bizobj_json_template = json.load(file)
-    final_bizobj_json = bizobjjsoncreate(bizobj_json_template, st.session_state.text)
-    st.session_state.bizobj = final_bizobj_json
-    questionobs = question_create(final_obs_json)
-    questionbizobj = question_create(final_bizobj_json)
-    while True:
-        try:
-            # Attempt to evaluate the expressions and assign them to session state
-            st.session_state.questions = ast.literal_eval(questionbizobj) + ast.literal_eval(questionobs)
-            # If successful, break out of the loop
-            break
-        except Exception as e:
-            # Print the error for debugging purposes (optional)
-            print(f"An error occurred: {e}")
-            # Wait for 1 second before trying again
-            time.sleep(1)
-            continue
+    try:
+        result = run_document_pipeline(uploaded_file)
+    except DocumentReadError as e:
+        st.error(str(e))
+        return
+    except (StructuredOutputError, TokenLimitError) as e:
+        st.error(f"Could not generate the questionnaire: {e}")
+        return
+    for key, value in result.items():
+        st.session_state[key] = value
     st.write(st.session_state.questions)
+    with st.expander("Pipeline metrics (stage timings in seconds, parse failures and retries)"):
+        st.write(st.session_state.stage_timings)
+        st.write(metrics)
+        st.write(telemetry.session_summary(st.session_state.session_id))
+        st.write(session_usage(st.session_state.session_id))
     # Mark file as processed
     st.session_state.file_processed = True
     st.success("Document processed successfully.")
 
 import json
 
+# Return {pointer: field} for every field marked as CONFLICT in the filled JSON.
+# The scan is local, so the conflict-resolution loop needs no LLM round trip.
 def check_for_conflicts(completed_json):
     # If completed_json is a string, try to parse it as JSON
     if isinstance(completed_json, str):
         try:
-            client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-            # Groq inference
-            completion = client.chat.completions.create(
-                model="llama-3.1-70b-versatile",
-                messages=[
-                    {
-                        "role": "system",
-                        "content":  "You are a helpful assistant. You will be given a unstructured JSON. I want you to convert it into a fully structured JSON which will become a structured CSV. The headings of the CSV are to be \\\"Category\\\",\\\"Sub-category\\\",\\\"Description\\\" and \\\"User Answer\\\". So shuffle around the fields accordingly. \nFields marked \"Category\" are to be directly picked as the \"Category\" for the CSV. If there is \"Observation type\", then that becomes the Category.  \nDONT LEAVE ANY FIELD. MAKE SURE ALL FIELDS ARE INCLUDED IN THE RESULT. DONT OUTPUT ANYTHING OTHER THAN THE JSON. ONLY OUTPUT THE JSON.\n"
-                    },
-                    {
-                        "role": "user",
-                        "content": completed_json
-                    }
-                ],
-                temperature=0.25,
-                max_tokens=8000,
-                top_p=1,
-                stream=True,
-                # response_format={"type": "json_object"},
-                stop=None,
-            )
-            content=""
-            for chunk in completion:
-                content+=chunk.choices[0].delta.content or ""
-            completed_json = json.loads(completed_json)
+            completed_json = parse_json_output(completed_json)
         except json.JSONDecodeError:
             st.error("The completed JSON is invalid.")
-            return False
-    
-    # Now ensure it's a dictionary before continuing
-    if isinstance(completed_json, dict):
-        for key, value in completed_json.items():
-            if isinstance(value, dict):
-                # Recursively check for conflicts in nested dictionaries
-                if check_for_conflicts(value):
-                    return True
-            elif isinstance(value, list):
-                # If the value is a list, check each element
-                for item in value:
-                    if isinstance(item, dict):
-                        if check_for_conflicts(item):
-                            return True
-                    elif item == "CONFLICT":
-                        return True
-            elif value == "CONFLICT":
-                return True
-    return False
+            return {}
+    return find_conflicts(completed_json)
 
 def chat_interaction():
     # Display chat messages from history in the correct order
@@ -598,7 +638,23 @@ def chat_interaction():
             st.write("The questionnaire is complete. Thank you for your responses!")
 
 def show_question():
+    if "speculation" not in st.session_state:
+        st.session_state.speculation = SpeculativeRefill(fill_fields)
+
     if st.session_state.current_question_index < len(st.session_state.questions):
+        # Re-fill the fields of the questions answered so far while the user answers the next one
+        if st.session_state.current_question_index > 0:
+            in_conflict_resolution = st.session_state.get('in_conflict_resolution', False)
+            speculate_refill(
+                st.session_state.speculation,
+                st.session_state.questions[:st.session_state.current_question_index],
+                [message["content"] for message in st.session_state.messages if message["role"] == "user"],
+                st.session_state.obs,
+                st.session_state.bizobj,
+                st.session_state.get('completed_json') if in_conflict_resolution else None,
+                resolve=in_conflict_resolution,
+            )
+
         # Display the next question
         with st.chat_message("assistant"):
             st.markdown(st.session_state.questions[st.session_state.current_question_index])
@@ -613,22 +669,27 @@ def show_question():
         # Display the answers after completing the questionnaire
         answers = [message["content"] for message in st.session_state.messages if message["role"] == "user"]
 
-        # Check if we're in conflict resolution mode
-        if st.session_state.get('in_conflict_resolution', False):
-            # Use answer_refill_conflict for conflict resolution
-            completed_json = answer_refill_conflict(st.session_state.conflict_questions, answers, st.session_state.obs, st.session_state.bizobj)
-            st.session_state.in_conflict_resolution = False
-        else:
-            # Use regular answer_refill for initial filling
-            completed_json = answer_refill(st.session_state.questions, answers, st.session_state.obs, st.session_state.bizobj)
+        try:
+            status, output, completed_json = complete_questionnaire(
+                st.session_state.questions,
+                st.session_state.conflict_questions,
+                answers,
+                st.session_state.obs,
+                st.session_state.bizobj,
+                st.session_state.get('in_conflict_resolution', False),
+                stream=True,
+                previous_json=st.session_state.get('completed_json'),
+                speculation=st.session_state.speculation,
+            )
+        except (StructuredOutputError, TokenLimitError) as e:
+            st.error(f"Could not complete the questionnaire: {e}")
+            return
+        st.session_state.in_conflict_resolution = False
+        st.session_state.completed_json = completed_json
 
-        # Check if there are any conflicts in the filled JSON
-        if check_for_conflicts(completed_json):
-            # Create conflict resolution questions
-            conflict_questions = question_create_conflict(completed_json)
-            
+        if status == "conflicts":
             # Update the questions and reset the index
-            st.session_state.conflict_questions = ast.literal_eval(conflict_questions)
+            st.session_state.conflict_questions = output
             st.session_state.questions = st.session_state.conflict_questions
             st.session_state.current_question_index = 0
             st.session_state.in_conflict_resolution = True
@@ -647,13 +708,56 @@ def show_question():
             st.session_state.current_question_index += 1
 
         else:
-            # Finalize the output if no conflicts
-            airtable_write(completed_json)
-            exec_summ = executive_summary(completed_json)
-            st.write(exec_summ)
+            # Render the executive summary token by token as it is generated
+            st.write_stream(output)
             
             # Reset the questionnaire state
             st.session_state.questionnaire_complete = True
 
+# Refill the JSON with the questionnaire answers and check it for conflicts.
+# Returns ("conflicts", conflict_questions, completed_json) when the user has to resolve
+# conflicts, otherwise writes the result to Airtable and returns ("complete", summary, completed_json).
+# With stream=True the summary is returned as a generator of text deltas.
+# speculation is the SpeculativeRefill that was updated with speculate_refill during the questionnaire.
+# With base_json (the completed JSON of a finished questionnaire) the answers are follow-ups that fill
+# its remaining open fields; its rows were exported before, so Airtable is only written again when the export upserts.
+def complete_questionnaire(questions, conflict_questions, answers, obs, bizobj, in_conflict_resolution, stream=False, previous_json=None, speculation=None, base_json=None):
+    completed_json = None
+    # Patch only the fields touched by the answers unless REFILL_MODE=full
+    if os.getenv("REFILL_MODE", "incremental") == "incremental":
+        if not in_conflict_resolution:
+            completed_json = answer_refill_incremental(questions, answers, obs, bizobj, base_json, speculation=speculation)
+        elif previous_json:
+            completed_json = answer_refill_incremental(conflict_questions, answers, obs, bizobj, previous_json, resolve=True, speculation=speculation)
+    if speculation is not None:
+        speculation.clear()
+
+    if completed_json is None and in_conflict_resolution:
+        # Use answer_refill_conflict for conflict resolution
+        completed_json = answer_refill_conflict(conflict_questions, answers, obs, bizobj)
+    elif completed_json is None and base_json:
+        completed_json = answer_refill(questions, answers, base_json, "")
+    elif completed_json is None:
+        # Use regular answer_refill for initial filling
+        completed_json = answer_refill(questions, answers, obs, bizobj)
+
+    # Check if there are any conflicts in the filled JSON
+    conflicts = check_for_conflicts(completed_json)
+    if conflicts:
+        # Create conflict resolution questions for the conflicting fields only
+        conflict_json = json.dumps(conflicts, ensure_ascii=False)
+        conflict_questions = generate_validated(
+            "question_create_conflict",
+            lambda attempt: question_create_conflict(conflict_json, refresh=attempt > 0),
+            lambda output: parse_question_map(output, list(conflicts)),
+        )
+        return "conflicts", conflict_questions, completed_json
+
+    # Finalize the output if no conflicts
+    airtable_write(completed_json, follow_up=bool(base_json))
+    if stream:
+        return "complete", executive_summary_stream(completed_json), completed_json
+    return "complete", executive_summary(completed_json), completed_json
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,60 @@
+import json
+from types import SimpleNamespace
+import httpx
+
+
+def _namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_namespace(item) for item in value]
+    return value
+
+
+# Streaming chat client for OpenAI-compatible servers (llama.cpp server, vLLM, Ollama, ...),
+# with the same chat.completions.create interface as the Groq client.
+# Token usage (including cached prompt tokens) is requested on the last chunk of the stream.
+# extra_body is merged into every request, e.g. {"cache_prompt": True} to make llama.cpp
+# reuse the KV cache of the shared prompt prefix.
+class OpenAICompatibleClient:
+    def __init__(self, base_url, api_key=None, timeout=120, http_client=None, extra_body=None):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.timeout = timeout
+        self.http = http_client or httpx.Client(timeout=timeout)
+        self.extra_body = extra_body or {}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature, max_tokens, top_p=1, stream=True, stop=None, timeout=None):
+        body = dict(
+            self.extra_body,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        if stop is not None:
+            body["stop"] = stop
+        return self._stream(body, timeout or self.timeout)
+
+    def _stream(self, body, timeout):
+        with self.http.stream("POST", self.url, json=body, headers=self.headers, timeout=timeout) as response:
+            if response.status_code >= 400:
+                response.read()
+                raise httpx.HTTPStatusError(
+                    f"{response.status_code} from {self.url}: {response.text[:500]}", request=response.request, response=response
+                )
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                # Role-only and final chunks may have an empty delta; content is always present, like on Groq
+                for choice in chunk.get("choices") or []:
+                    choice.setdefault("delta", {}).setdefault("content", None)
+                yield _namespace(chunk)
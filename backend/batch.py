@@ -0,0 +1,94 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Headless batch mode: run every PDF of a directory through the document pipeline
+# (extraction, classification, observation and BizObj fills, questions) without Streamlit.
+#
+#   python batch.py rfqs/ results/ --workers 4 --max-concurrency 8 --requests-per-minute 30
+#
+# Each finished document is checkpointed to <output>/<name>-<hash>.json, so an interrupted
+# run resumes with the documents that are not done yet. Failed documents are retried on the next run.
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def checkpoint_path(output_dir, pdf_path, digest):
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(output_dir, f"{name}-{digest[:12]}.json")
+
+
+# Write through a temporary file so an interrupted run never leaves a half-written checkpoint
+def write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def process_file(app, telemetry, pdf_path, output_dir, keep_text=False):
+    with open(pdf_path, "rb") as file:
+        data = file.read()
+    digest = file_hash(data)
+    path = checkpoint_path(output_dir, pdf_path, digest)
+    if os.path.exists(path):
+        return {"file": pdf_path, "status": "skipped", "checkpoint": path}
+
+    start = time.perf_counter()
+    # The document hash is the telemetry session, so each document gets its own trace
+    with telemetry.session(digest):
+        result = app.run_document_pipeline(data)
+    if not keep_text:
+        result.pop("text")
+    write_json(path, dict(result, file=pdf_path, sha256=digest))
+    return {"file": pdf_path, "status": "done", "checkpoint": path, "seconds": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a directory of PDFs through the document pipeline")
+    parser.add_argument("input_dir", help="directory with the PDF documents")
+    parser.add_argument("output_dir", help="directory for the per-document results and the run summary")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BATCH_WORKERS", 2)), help="documents processed at the same time")
+    parser.add_argument("--max-concurrency", type=int, default=int(os.getenv("GROQ_MAX_CONCURRENCY", 0)), help="Groq requests open at the same time across all documents (0 = unlimited)")
+    parser.add_argument("--requests-per-minute", type=float, default=float(os.getenv("GROQ_REQUESTS_PER_MINUTE", 0)), help="Groq requests started per minute across all documents (0 = unlimited)")
+    parser.add_argument("--recursive", action="store_true", help="also process PDFs in subdirectories")
+    parser.add_argument("--keep-text", action="store_true", help="store the extracted text in the results")
+    args = parser.parse_args()
+
+    import app
+    import llm
+    import telemetry
+
+    llm.set_limits(args.max_concurrency, args.requests_per_minute)
+    pattern = os.path.join(args.input_dir, "**", "*.pdf") if args.recursive else os.path.join(args.input_dir, "*.pdf")
+    pdf_paths = sorted(glob.glob(pattern, recursive=args.recursive))
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"Processing {len(pdf_paths)} documents with {args.workers} workers")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(process_file, app, telemetry, path, args.output_dir, args.keep_text): path for path in pdf_paths}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"file": futures[future], "status": "failed", "error": f"{type(e).__name__}: {e}"}
+            results.append(result)
+            print(f"[{len(results)}/{len(pdf_paths)}] {result['status']}: {result['file']}" + (f" ({result['error']})" if "error" in result else ""))
+
+    results.sort(key=lambda result: result["file"])
+    write_json(os.path.join(args.output_dir, "summary.json"), results)
+    failed = sum(result["status"] == "failed" for result in results)
+    print(f"{len(results) - failed} documents done, {failed} failed")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
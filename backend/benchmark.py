@@ -0,0 +1,383 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Offline benchmark of the document pipeline, the questionnaire refill, the executive summary
+# and the Airtable export. Groq is replaced by a mock client that streams synthetic (or recorded)
+# answers with a configurable latency, and Airtable by a local server, so no tokens are spent.
+#
+#   python benchmark.py --pages 1,10,50 --token-latency 0.002
+#   python benchmark.py --record recorded.json   # run once against Groq and record the answers
+#   python benchmark.py --replay recorded.json   # replay them offline
+#   python benchmark.py --observations           # compare the observation fill modes
+
+# The app reads these at import time, so they are set before it is imported below
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("SESSION_STORE", "none")
+os.environ.setdefault("AIRTABLE_KEY", "benchmark")
+
+# Characters per token used to estimate token counts
+CHARS_PER_TOKEN = 4
+
+WORDS = (
+    "inspection camera line conveyor part diameter thickness tolerance scratch dent label barcode "
+    "print station throughput cycle time lighting lens resolution operator reject budget plant "
+    "assembly component color surface defect measurement accuracy shift batch supplier integration"
+).split()
+REQUIREMENTS = [
+    "The diameter of the part must be measured to +/- 0.01 mm.",
+    "Parts move on the conveyor at 2 m/s with a cycle time of 300 ms.",
+    "Scratches and dents larger than 0.5 mm must be rejected.",
+    "Every label carries a DataMatrix code and a printed lot number to be read.",
+    "The budget for the inspection station is 40,000 USD.",
+    "The system has to integrate with the Siemens PLC on the line.",
+]
+
+
+# Build a PDF of the given number of pages of RFQ-like text, without any PDF library
+def make_pdf(pages, lines_per_page=45, seed=0):
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(pages):
+        lines = [f"Request for quotation - page {page + 1}"]
+        for line in range(lines_per_page):
+            if line % 9 == 0:
+                lines.append(rng.choice(REQUIREMENTS))
+            else:
+                lines.append(" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + ".")
+        text = "\n".join(f"({line}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 50 800 Td\n{text}\nET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {pages} >>"
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return output
+
+
+def _json_after(text, marker, end_marker=None):
+    start = text.find(marker)
+    if start == -1:
+        return None
+    body = text[start + len(marker):]
+    if end_marker and end_marker in body:
+        body = body[:body.index(end_marker)]
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        return None
+
+
+# Fill every field of a template: one in three stays TBD, the rest get a synthetic answer
+def _fill_template(data, counter):
+    if isinstance(data, list):
+        return [_fill_template(item, counter) for item in data]
+    if not isinstance(data, dict):
+        return data
+    filled = {key: _fill_template(value, counter) for key, value in data.items()}
+    if "User Answer" in data or ("description" in data and data.get("type") != "object"):
+        counter[0] += 1
+        filled["User Answer"] = "TBD" if counter[0] % 3 == 0 else f"Synthetic answer {counter[0]}"
+    return filled
+
+
+# Deterministic stand-in for the model: recognises each prompt by its system message and
+# returns an answer of the shape the app expects
+def synthetic_answer(messages):
+    system = messages[0]["content"]
+    user = messages[-1]["content"]
+    if "list of choices" in system:
+        return json.dumps(["2D Measurement", "Anomaly Detection", "Code Reading"])
+    if "return a JSON where only the fields" in system:
+        # Keep the observations of the classified choices, like a good cut would
+        template = _json_after(user, "JSON:", "\nText:") or []
+        choices = _json_after(user, "\nText:") or []
+        return json.dumps([item for item in template if any(item["Observation Type"] == choice or item["Observation Type"].startswith(choice + " ") for choice in choices)])
+    if "populate a JSON structure" in system or "fill up the JSON subproperty" in system:
+        template = _json_after(user, "JSON: ", "\n Text: ")
+        return json.dumps(_fill_template(template, [0]))
+    if "mapping field paths" in system:
+        fields = _json_after(user, "Fields:\n") or {}
+        return json.dumps({pointer: "Synthetic refill" for pointer in fields})
+    if "question-answer pair array and a two JSON" in system:
+        return user[len("JSON:\n"):user.rfind("\nQuestion Answer:")]
+    if "question-answer pair array" in system:
+        return json.dumps([f"Question: {index}" for index in range(user.count("?"))])
+    if "maps every path to its question" in system:
+        return json.dumps({pointer: f"What is the right value for {pointer}?" for pointer in json.loads(user)})
+    if "refining a set of questions" in system:
+        return user
+    if "create questions" in system:
+        # One question per open field, on topics that depend on the prompt so the two lists only partly overlap
+        count = min(user.count("TBD") + user.count("CONFLICT"), 10)
+        offset = len(user) % len(WORDS)
+        return json.dumps([f"What {WORDS[(offset + index) % len(WORDS)]} is required?" for index in range(max(count, 1))])
+    if "executive summary" in system:
+        # About a sentence per field, so the summary grows with the JSON like a real one
+        fields = user.count("User Answer") + user.count("description")
+        text = " ".join(WORDS[index % len(WORDS)] for index in range(15 * max(fields, 4)))
+        return text if "one section" in system else "# Executive Summary\n\n" + text
+    return "OK"
+
+
+def _chunk(piece):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+# Stands in for the Groq client: streams the recorded answer for a request if there is one,
+# otherwise a synthetic answer, in pieces of CHARS_PER_TOKEN characters with the given latencies.
+# Counts calls and estimated prompt/completion tokens.
+class MockClient:
+    def __init__(self, first_token_latency=0.2, token_latency=0.002, recorded=None):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.recorded = recorded or {}
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature, max_tokens, top_p=1, stream=True, **kwargs):
+        from llm_cache import completion_key
+
+        key = completion_key(model, messages, temperature, max_tokens, top_p)
+        answer = self.recorded.get(key)
+        if answer is None:
+            answer = synthetic_answer(messages)
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_chars // CHARS_PER_TOKEN
+            self.completion_tokens += len(answer) // CHARS_PER_TOKEN
+        return self._stream(answer)
+
+    def _stream(self, answer):
+        time.sleep(self.first_token_latency)
+        for start in range(0, len(answer), CHARS_PER_TOKEN):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield _chunk(answer[start:start + CHARS_PER_TOKEN])
+
+    def reset(self):
+        with self._lock:
+            self.calls = self.prompt_tokens = self.completion_tokens = 0
+
+
+# Wraps the real client and records every streamed answer by request key, for later replay
+class RecordingClient:
+    def __init__(self, client, recorded=None):
+        self.client = client
+        self.recorded = {} if recorded is None else recorded
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature, max_tokens, top_p=1, **kwargs):
+        from llm_cache import completion_key
+
+        key = completion_key(model, messages, temperature, max_tokens, top_p)
+        completion = self.client.chat.completions.create(
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, top_p=top_p, **kwargs
+        )
+
+        def stream():
+            pieces = []
+            for chunk in completion:
+                # Skip the usage-only last chunk (no choices) and deltas without content
+                if chunk.choices:
+                    pieces.append(getattr(chunk.choices[0].delta, "content", None) or "")
+                yield chunk
+            with self._lock:
+                self.recorded[key] = "".join(pieces)
+
+        return stream()
+
+
+# Local stand-in for the Airtable API that accepts every batch
+class AirtableHandler(BaseHTTPRequestHandler):
+    def _accept(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        records = json.loads(body or b"{}").get("records", [])
+        response = json.dumps({"records": [dict(record, id=f"rec{index}") for index, record in enumerate(records)]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_POST = do_PATCH = _accept
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_airtable_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AirtableHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(timings, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings[name] = time.perf_counter() - start
+    return result
+
+
+# Run one synthetic document through the whole flow and return its measurements
+def run_case(app, client, pages):
+    pdf = make_pdf(pages, seed=pages)
+    client.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    timings = {}
+
+    result = timed(timings, "process_document", app.run_document_pipeline, pdf)
+    questions = result["questions"]
+    answers = [f"Synthetic answer to question {index + 1}" for index in range(len(questions))]
+    filled = timed(timings, "answer_refill", app.answer_refill_incremental, questions, answers, result["obs"], result["bizobj"])
+    if filled is None:
+        filled = timed(timings, "answer_refill", app.answer_refill, questions, answers, result["obs"], result["bizobj"])
+    timed(timings, "executive_summary", lambda: "".join(app.executive_summary_stream(filled)))
+    export = timed(timings, "airtable_write", app.airtable_write, filled)
+
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stage_timings = {name: seconds for name, seconds in result["stage_timings"].items() if name != "extract_pages" and isinstance(seconds, (int, float))}
+    return {
+        "pages": pages,
+        "pdf_bytes": len(pdf),
+        "text_chars": len(result["text"]),
+        "questions": len(questions),
+        "records_written": export["written"] if export else 0,
+        "total_seconds": total,
+        "timings": timings,
+        "stage_timings": stage_timings,
+        "llm_calls": client.calls,
+        "prompt_tokens": client.prompt_tokens,
+        "completion_tokens": client.completion_tokens,
+        "peak_memory_mb": peak / 2 ** 20,
+    }
+
+
+# Fill the observations of one document with every OBS_FILL_MODE and measure each path
+def compare_observation_modes(app, client, pages):
+    pdf = make_pdf(pages, seed=pages)
+    text = app.extract_text_from_pdf(pdf)
+    index = app.build_index(text)
+    classification = app.classification_LLM(text, index)
+    modes = {}
+    for mode in app.OBS_FILL_MODES:
+        client.reset()
+        start = time.perf_counter()
+        app.obsjsoncreate(app.templates.obs_template, classification, text, index, mode=mode)
+        modes[mode] = {
+            "seconds": time.perf_counter() - start,
+            "llm_calls": client.calls,
+            "prompt_tokens": client.prompt_tokens,
+            "completion_tokens": client.completion_tokens,
+        }
+    return {"pages": pages, "modes": modes}
+
+
+def print_observation_report(report):
+    print(f"{'pages':>5} {'mode':<13} {'seconds':>8} {'calls':>5} {'prompt tok':>10} {'compl tok':>9}")
+    for case in report:
+        for mode, result in case["modes"].items():
+            print(f"{case['pages']:>5} {mode:<13} {result['seconds']:>8.2f} {result['llm_calls']:>5} {result['prompt_tokens']:>10} {result['completion_tokens']:>9}")
+
+
+def print_report(report):
+    header = f"{'pages':>5} {'total s':>8} {'document s':>10} {'refill s':>8} {'summary s':>9} {'airtable s':>10} {'calls':>5} {'prompt tok':>10} {'compl tok':>9} {'peak MB':>7}"
+    print(header)
+    for case in report:
+        timings = case["timings"]
+        print(
+            f"{case['pages']:>5} {case['total_seconds']:>8.2f} {timings['process_document']:>10.2f} {timings['answer_refill']:>8.2f} "
+            f"{timings['executive_summary']:>9.2f} {timings['airtable_write']:>10.2f} {case['llm_calls']:>5} "
+            f"{case['prompt_tokens']:>10} {case['completion_tokens']:>9} {case['peak_memory_mb']:>7.1f}"
+        )
+    for case in report:
+        stages = ", ".join(f"{name} {seconds:.2f}" for name, seconds in case["stage_timings"].items())
+        print(f"{case['pages']} pages: {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline against a mock Groq backend")
+    parser.add_argument("--pages", default="1,10,50,200", help="comma separated page counts of the synthetic PDFs")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="seconds before the first token of each answer")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="seconds between streamed tokens")
+    parser.add_argument("--replay", help="JSON file of recorded answers to replay; missing requests get synthetic answers")
+    parser.add_argument("--record", help="call Groq for real and write the recorded answers to this JSON file")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--observations", action="store_true", help="compare the observation fill modes (OBS_FILL_MODE) instead of the full flow")
+    args = parser.parse_args()
+
+    airtable = None
+    if not args.record:
+        airtable = start_airtable_server()
+        os.environ["AIRTABLE_API_URL"] = f"http://127.0.0.1:{airtable.server_port}"
+
+    import app
+    import llm
+
+    recorded = {}
+    if args.record:
+        # Record the answers of every configured backend into one file
+        for backend in llm.BACKENDS:
+            if backend == "remote" or llm.LOCAL_API_BASE:
+                llm.set_client(RecordingClient(llm.get_client(backend), recorded), backend)
+    else:
+        if args.replay:
+            with open(args.replay) as file:
+                recorded = json.load(file)
+        client = MockClient(args.first_token_latency, args.token_latency, recorded)
+        llm.set_client(client)
+
+    report = []
+    for pages in [int(pages) for pages in re.split(r"[,\s]+", args.pages.strip()) if pages]:
+        if args.record:
+            start = time.perf_counter()
+            app.run_document_pipeline(make_pdf(pages, seed=pages))
+            print(f"Recorded {pages} pages in {time.perf_counter() - start:.2f}s")
+            continue
+        if args.observations:
+            report.append(compare_observation_modes(app, client, pages))
+            continue
+        report.append(run_case(app, client, pages))
+
+    if args.record:
+        with open(args.record, "w") as file:
+            json.dump(recorded, file)
+        print(f"{len(recorded)} answers recorded to {args.record}")
+        return
+    if args.observations:
+        print_observation_report(report)
+    else:
+        print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    airtable.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import contextvars
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from tokens import PromptTooLongError
+
+# Prompts whose template + text exceed this many characters are split into chunks
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", 24000))
+# Characters shared between neighbouring text chunks so answers on a boundary are not lost
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 500))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", 4))
+
+EMPTY_ANSWERS = ("", "TBD", None)
+
+
+# Split the document text into chunks of at most max_chars, preferring paragraph and line breaks
+def split_text(text, max_chars, overlap=CHUNK_OVERLAP):
+    if len(text) <= max_chars:
+        return [text]
+    overlap = min(overlap, max_chars // 4)
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            # Cut at the last paragraph or line break in the second half of the window
+            for separator in ("\n\n", "\n", ". "):
+                cut = text.rfind(separator, start + max_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = end - overlap
+    return chunks
+
+
+# Split a JSON template into batches whose serialized size stays under max_chars.
+# JSON schemas are split on their top-level "properties" (BIZ_OBJ, PROD_VARIANT_INFO, ...),
+# other dicts on their keys and lists on their items.
+def split_template(template, max_chars):
+    if isinstance(template, dict) and isinstance(template.get("properties"), dict):
+        header = {key: value for key, value in template.items() if key not in ("properties", "required")}
+        return [dict(header, properties=dict(batch)) for batch in _batches(list(template["properties"].items()), max_chars)]
+    if isinstance(template, dict):
+        return [dict(batch) for batch in _batches(list(template.items()), max_chars)]
+    if isinstance(template, list):
+        return _batches(template, max_chars)
+    return [template]
+
+
+def _batches(items, max_chars):
+    batches = []
+    current = []
+    size = 0
+    for item in items:
+        item_size = len(json.dumps(item, ensure_ascii=False))
+        if current and size + item_size > max_chars:
+            batches.append(current)
+            current = []
+            size = 0
+        current.append(item)
+        size += item_size
+    if current:
+        batches.append(current)
+    return batches
+
+
+# Parse the JSON an LLM returned, ignoring code fences and text around it
+def parse_json_output(output):
+    output = re.sub(r"^```(?:json)?|```$", "", output.strip(), flags=re.MULTILINE).strip()
+    try:
+        return json.loads(output)
+    except json.JSONDecodeError:
+        starts = [index for index in (output.find("{"), output.find("[")) if index != -1]
+        if not starts:
+            raise
+        start = min(starts)
+        end = max(output.rfind("}"), output.rfind("]")) + 1
+        return json.loads(output[start:end])
+
+
+# Combine two "User Answer" values: a real answer beats TBD, and two different answers are a CONFLICT
+def merge_answer(first, second):
+    if first in EMPTY_ANSWERS:
+        return second
+    if second in EMPTY_ANSWERS:
+        return first
+    if first == "CONFLICT" or second == "CONFLICT":
+        return "CONFLICT"
+    if str(first).strip().lower() == str(second).strip().lower():
+        return first
+    return "CONFLICT"
+
+
+# Identity of a list item, used to match the same field across partial results
+def _item_identity(item):
+    if isinstance(item, dict):
+        return json.dumps({key: value for key, value in item.items() if key != "User Answer"}, sort_keys=True)
+    return json.dumps(item, sort_keys=True)
+
+
+# Deterministically merge two partial results. Keys and list items keep the order in which
+# they first appear, so merging the partials in chunk order always gives the same output.
+def merge_partials(first, second):
+    if isinstance(first, dict) and isinstance(second, dict):
+        merged = dict(first)
+        for key, value in second.items():
+            if key not in merged:
+                merged[key] = value
+            elif key == "User Answer":
+                merged[key] = merge_answer(merged[key], value)
+            else:
+                merged[key] = merge_partials(merged[key], value)
+        return merged
+    if isinstance(first, list) and isinstance(second, list):
+        merged = list(first)
+        positions = {_item_identity(item): index for index, item in enumerate(merged)}
+        for item in second:
+            identity = _item_identity(item)
+            if identity in positions:
+                merged[positions[identity]] = merge_partials(merged[positions[identity]], item)
+            else:
+                positions[identity] = len(merged)
+                merged.append(item)
+        return merged
+    if first in EMPTY_ANSWERS:
+        return second
+    return first
+
+
+# Fill a template from a text chunk, halving the chunk until the prompt fits the context window.
+# Returns the outputs of all the calls that were made.
+def fill_fitting(fill, template, text, min_chars=1000):
+    try:
+        return [fill(template, text)]
+    except PromptTooLongError:
+        if len(text) < 2 * min_chars:
+            raise
+    return [output for part in split_text(text, len(text) // 2 + 1, overlap=0) for output in fill_fitting(fill, template, part, min_chars)]
+
+
+# Fill a JSON template from the document text with fill(template, text) -> JSON string.
+# Small inputs are sent in one call. Larger ones are split into template batches; each batch is
+# filled either from the passages a retrieval index returns for it or, without an index, from
+# every text chunk. The calls run in parallel and the partial results are merged. Chunks whose
+# prompt does not fit the model's context window are halved until they do.
+def chunked_fill(fill, json_template, text, max_chars=CHUNK_MAX_CHARS, workers=CHUNK_WORKERS, index=None):
+    if index is None and len(str(json_template)) + len(text) <= max_chars:
+        try:
+            return fill(json_template, text)
+        except PromptTooLongError:
+            # Too long for the model's context window after all; split it below
+            max_chars = len(str(json_template)) + len(text) // 2
+
+    if isinstance(json_template, str):
+        try:
+            json_template = parse_json_output(json_template)
+        except json.JSONDecodeError:
+            pass
+
+    # Give half of the budget to the template and half to the text
+    batches = split_template(json_template, max_chars // 2) if not isinstance(json_template, str) else [json_template]
+    if index is not None:
+        jobs = [(batch, index.template_context(batch)) for batch in batches]
+    else:
+        chunks = split_text(text, max_chars // 2)
+        jobs = [(batch, chunk) for batch in batches for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Jobs run in a copy of the caller's context, so their LLM calls keep the caller's telemetry session
+        futures = [executor.submit(contextvars.copy_context().run, fill_fitting, fill, *job) for job in jobs]
+        outputs = [output for future in futures for output in future.result()]
+
+    merged = None
+    for output in outputs:
+        try:
+            partial = parse_json_output(output)
+        except json.JSONDecodeError:
+            print(f"Skipping a partial result that is not valid JSON: {output[:200]}")
+            continue
+        merged = partial if merged is None else merge_partials(merged, partial)
+    return json.dumps(merged if merged is not None else json_template, indent=2)
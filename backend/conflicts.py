@@ -0,0 +1,25 @@
+from refill import json_pointer
+
+
+def is_conflict(value):
+    return isinstance(value, str) and value.strip().upper() == "CONFLICT"
+
+
+# Scan a filled template once and return {pointer: field} for every value marked CONFLICT, in document order.
+# The field is the object holding the "User Answer" (so its description stays available) or the value itself.
+# The pointer (RFC 6901) is the field's, as in refill.open_fields, or the value's when it is not a "User Answer".
+def find_conflicts(data):
+    conflicts = {}
+    stack = [(data, (), None)]
+    while stack:
+        value, path, parent = stack.pop()
+        if isinstance(value, dict):
+            stack.extend((child, path + (key,), value) for key, child in reversed(list(value.items())))
+        elif isinstance(value, list):
+            stack.extend((child, path + (index,), value) for index, child in reversed(list(enumerate(value))))
+        elif is_conflict(value):
+            if isinstance(parent, dict) and path[-1] == "User Answer":
+                conflicts[json_pointer(path[:-1])] = parent
+            else:
+                conflicts[json_pointer(path)] = value
+    return conflicts
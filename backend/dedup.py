@@ -0,0 +1,161 @@
+import os
+import re
+import numpy as np
+from retrieval import STOPWORDS
+
+# Local near-duplicate removal for the generated questions. A question of one list (BizObj) is
+# merged with a question of another list (observations) when both ask for the same information;
+# questions within one list are never merged. Set QUESTION_DEDUP=1 to enable it.
+
+QUESTION_DEDUP = os.getenv("QUESTION_DEDUP", "0") == "1"
+# Questions at least this similar are treated as duplicates. Tuned with tune_threshold on the
+# tuning pairs of tests/test_dedup.py; re-tune it when switching to an embedding model.
+QUESTION_DEDUP_THRESHOLD = float(os.getenv("QUESTION_DEDUP_THRESHOLD", 0.61))
+# Sentence-transformers model for the word embeddings (e.g. all-MiniLM-L6-v2);
+# without it words are compared by character n-grams
+EMBEDDING_MODEL = os.getenv("QUESTION_EMBEDDING_MODEL")
+SUFFIXES = ("ing", "ed", "es", "s", "e")
+NGRAM_SIZES = (3, 4, 5)
+
+# Words every question shares (question phrasing and the vision-system domain); they say nothing
+# about which field a question asks for
+BOILERPLATE = STOPWORDS | {
+    "what", "which", "who", "how", "when", "where", "why", "is", "are", "do", "does", "can", "could",
+    "would", "should", "you", "your", "we", "our", "us", "i", "me", "my", "please", "kindly", "provide",
+    "specify", "describe", "tell", "let", "know", "any", "there", "have", "has", "need", "needs", "needed",
+    "require", "required", "requires", "requirement", "requirements", "expected", "much", "many",
+    "about", "its", "their", "they", "them", "system", "vision", "inspection", "solution", "project",
+    "part", "parts", "value", "details", "information", "type", "kind", "specific", "measured",
+}
+# Words that tell otherwise identical questions apart; questions with different ones are never merged
+QUALIFIERS = {
+    "min", "minimum", "max", "maximum", "upper", "lower", "inner", "outer", "inside", "outside",
+    "left", "right", "top", "bottom", "front", "back", "first", "last", "start", "end", "input",
+    "output", "before", "after", "horizontal", "vertical", "internal", "external", "new", "old",
+    "smallest", "largest", "lowest", "highest", "shortest", "longest", "slowest", "fastest",
+}
+
+_embedder = None
+
+
+def stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 2:
+            return word[:-len(suffix)]
+    return word
+
+
+def content_words(question):
+    return [word for word in re.findall(r"[a-z0-9]+", question.lower()) if word not in BOILERPLATE]
+
+
+def qualifiers(question):
+    return frozenset(word for word in re.findall(r"[a-z0-9]+", question.lower()) if word in QUALIFIERS or word.isdigit())
+
+
+# Log-scaled character n-gram counts (within word boundaries) of each text, one row per text.
+# No IDF weighting: the boilerplate is already removed, and the scores do not depend on the other questions.
+def ngram_vectors(texts):
+    vocabulary = {}
+    rows = []
+    for text in texts:
+        counts = {}
+        for word in text.split():
+            word = f" {word} "
+            for size in NGRAM_SIZES:
+                for start in range(max(len(word) - size + 1, 1)):
+                    column = vocabulary.setdefault(word[start:start + size], len(vocabulary))
+                    counts[column] = counts.get(column, 0) + 1
+        rows.append(counts)
+
+    tf = np.zeros((len(texts), len(vocabulary)))
+    for row, counts in enumerate(rows):
+        tf[row, list(counts)] = list(counts.values())
+    return np.log1p(tf)
+
+
+def embedding_vectors(texts):
+    global _embedder
+    if _embedder is None:
+        from sentence_transformers import SentenceTransformer
+
+        _embedder = SentenceTransformer(EMBEDDING_MODEL)
+    return np.asarray(_embedder.encode(texts))
+
+
+# Unit vectors of the words
+def word_vectors(words):
+    vectors = embedding_vectors(words) if EMBEDDING_MODEL else ngram_vectors(words)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# Pairwise question similarity: how well the question with the better covered words is contained
+# in the other one, i.e. the weakest match (cosine to the closest word of the other question) among
+# its stemmed content words. Extra words on one side ("on the production line") cost nothing, a word
+# swapped for another ("PLC" for "robot") leaves both questions with an unmatched word.
+def question_similarity(questions):
+    question_words = [[stem(word) for word in content_words(question)] for question in questions]
+    vocabulary = sorted({word for words in question_words for word in words})
+    similarity = np.zeros((len(questions), len(questions)))
+    if not vocabulary:
+        return similarity
+    vectors = word_vectors(vocabulary)
+    word_similarity = vectors @ vectors.T
+    columns = [[vocabulary.index(word) for word in words] for words in question_words]
+    for first in range(len(questions)):
+        for second in range(first + 1, len(questions)):
+            if columns[first] and columns[second]:
+                matches = word_similarity[np.ix_(columns[first], columns[second])]
+                similarity[first, second] = similarity[second, first] = max(matches.max(axis=1).min(), matches.max(axis=0).min())
+    return similarity
+
+
+# The threshold that separates labelled (question, question, is_duplicate) pairs: halfway between the
+# most similar non-duplicate and the least similar duplicate above it. Pairs with different
+# qualifiers are never merged and do not count.
+def tune_threshold(pairs):
+    scores = [(question_similarity([first, second])[0, 1], duplicate) for first, second, duplicate in pairs if qualifiers(first) == qualifiers(second)]
+    distinct = max((score for score, duplicate in scores if not duplicate), default=0)
+    duplicates = [score for score, duplicate in scores if duplicate and score > distinct]
+    return (distinct + min(duplicates)) / 2 if duplicates else distinct
+
+
+# Group near-duplicate questions across lists. sources[i] is the list question i comes from;
+# a cluster holds at most one question per list and all of its members must be at least
+# threshold similar (complete linkage) with the same qualifiers.
+# Returns lists of question indices in order of first appearance.
+def cluster_questions(questions, sources, threshold=QUESTION_DEDUP_THRESHOLD):
+    if not questions:
+        return []
+    similarity = question_similarity(questions)
+    question_qualifiers = [qualifiers(question) for question in questions]
+    clusters = []
+    for index in range(len(questions)):
+        for cluster in clusters:
+            if (
+                all(sources[member] != sources[index] for member in cluster)
+                and all(question_qualifiers[member] == question_qualifiers[index] for member in cluster)
+                and similarity[index, cluster].min() >= threshold
+            ):
+                cluster.append(index)
+                break
+        else:
+            clusters.append([index])
+    return clusters
+
+
+# Merge the question lists into one without near-duplicates. Each cluster keeps its longest
+# question (usually the one that also asks for units or format) at the position of its first member.
+def dedupe_questions(*question_lists, threshold=QUESTION_DEDUP_THRESHOLD):
+    questions = [question for question_list in question_lists for question in question_list]
+    sources = [source for source, question_list in enumerate(question_lists) for _ in question_list]
+    clusters = cluster_questions(questions, sources, threshold)
+    return [max((questions[index] for index in cluster), key=len) for cluster in clusters]
+
+
+# The questionnaire: the question lists one after the other, deduplicated when QUESTION_DEDUP=1
+def merge_questions(*question_lists):
+    if QUESTION_DEDUP:
+        return dedupe_questions(*question_lists)
+    return [question for question_list in question_lists for question in question_list]
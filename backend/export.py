@@ -0,0 +1,70 @@
+import csv
+import json
+
+COLUMNS = ["Category", "Sub-category", "Description", "User Answer"]
+# Keys that only carry schema bookkeeping and never lead to a field
+SCHEMA_KEYS = {"$schema", "type", "required", "title"}
+# Container keys that are not meaningful as a category or sub-category
+STRUCTURAL_KEYS = {"properties", "items"}
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+# Yield one Category/Sub-category/Description/User Answer row per field of a filled template, in
+# document order. A field is any object with a "User Answer". Its "Category" (or "Observation Type")
+# is the category when present, otherwise the top-level section it sits in (BIZ_OBJ, SOFTWARE, ...).
+def iter_rows(data):
+    stack = [(data, ())]
+    while stack:
+        node, path = stack.pop()
+        if isinstance(node, dict):
+            if "User Answer" in node:
+                yield _row(node, path)
+                continue
+            stack.extend(
+                (child, path + (key,))
+                for key, child in reversed(list(node.items()))
+                if key not in SCHEMA_KEYS and isinstance(child, (dict, list))
+            )
+        elif isinstance(node, list):
+            stack.extend((child, path) for child in reversed(node))
+
+
+def _row(field, path):
+    keys = [key for key in path if key not in STRUCTURAL_KEYS]
+    category = field.get("Category") or field.get("Observation Type") or (keys[0] if keys else "")
+    sub_category = field.get("Sub-category") or field.get("Sub-Parameters") or (keys[-1] if keys else "")
+    description = field.get("Description") or field.get("description") or field.get("Example") or ""
+    return {
+        "Category": _text(category),
+        "Sub-category": _text(sub_category),
+        "Description": _text(description),
+        "User Answer": _text(field["User Answer"]),
+    }
+
+
+def write_csv(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_ndjson(rows, path):
+    with open(path, "w", encoding="utf-8") as file:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+# Parquet export needs pyarrow, which is only imported when it is used
+def write_parquet(rows, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = list(rows)
+    table = pa.table({column: [row[column] for row in rows] for column in COLUMNS})
+    pq.write_table(table, path)
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import httpx
+from groq import Groq
+from dotenv import load_dotenv
+from llm_cache import CompletionCache, completion_key
+from ratelimit import RateLimiter
+from backends import OpenAICompatibleClient
+import telemetry
+import tokens
+
+load_dotenv()
+
+DEFAULT_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
+DEFAULT_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", 120))
+
+# LLM backends: "remote" is Groq (or the server at LLM_API_BASE) and "local" is a small model on an
+# OpenAI-compatible server on this machine (llama.cpp, Ollama, ...) at LOCAL_LLM_API_BASE.
+# Without LOCAL_LLM_API_BASE every stage uses the remote backend.
+BACKENDS = ("remote", "local")
+LOCAL_API_BASE = os.getenv("LOCAL_LLM_API_BASE")
+LOCAL_MODEL = os.getenv("LOCAL_LLM_MODEL", "llama-3.2-3b-instruct")
+
+# Model, request timeout (seconds) and backend per LLM stage. Stages not listed here use
+# DEFAULT_MODEL, DEFAULT_TIMEOUT and the remote backend. The cheap stages (picking labels,
+# polishing questions) go to the local backend when there is one.
+# LLM_BACKEND_<STAGE> overrides the backend of one stage and LLM_BACKEND the backend of all stages
+# (LLM_BACKEND=local keeps the app working offline); GROQ_MODEL_<STAGE> overrides the model of one stage.
+STAGE_CONFIG = {
+    "classification": {"timeout": 60, "backend": "local"},
+    "obs_cut": {"timeout": 180},
+    "obs_fill": {"timeout": 180},
+    "bizobj_fill": {"timeout": 180},
+    "question_create": {"timeout": 60},
+    "question_refine": {"timeout": 60, "backend": "local"},
+    "qa_pair": {"timeout": 60},
+    "answer_refill": {"timeout": 180},
+    "answer_refill_fields": {"timeout": 60},
+    "question_create_conflict": {"timeout": 60},
+    "qa_pair_conflict": {"timeout": 60},
+    "answer_refill_conflict": {"timeout": 180},
+    "executive_summary": {"timeout": 180},
+    "executive_summary_section": {"timeout": 120},
+}
+
+# Completion cache shared by every LLM call. Set LLM_CACHE=0 to disable it.
+cache = None
+if os.getenv("LLM_CACHE", "1") != "0":
+    cache = CompletionCache(
+        path=os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3"),
+        ttl=float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600)),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1000)),
+    )
+
+_clients = {}
+_client_lock = threading.Lock()
+
+# Limits on remote (Groq) requests shared by every thread of the process: at most GROQ_MAX_CONCURRENCY
+# streams open at once and GROQ_REQUESTS_PER_MINUTE requests started per minute (0 = unlimited)
+_concurrency = None
+_rate_limiter = None
+
+
+def _create_client(backend):
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", 10)),
+        max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", 10)),
+        keepalive_expiry=float(os.getenv("GROQ_KEEPALIVE_EXPIRY", 60)),
+    )
+    http_client = httpx.Client(limits=limits, timeout=DEFAULT_TIMEOUT)
+    if backend == "local":
+        return OpenAICompatibleClient(
+            LOCAL_API_BASE,
+            timeout=DEFAULT_TIMEOUT,
+            http_client=http_client,
+            extra_body=json.loads(os.getenv("LOCAL_LLM_EXTRA_BODY", '{"cache_prompt": true}')),
+        )
+    if os.getenv("LLM_API_BASE"):
+        return OpenAICompatibleClient(
+            os.getenv("LLM_API_BASE"),
+            api_key=os.getenv("LLM_API_KEY"),
+            timeout=DEFAULT_TIMEOUT,
+            http_client=http_client,
+            extra_body=json.loads(os.getenv("LLM_EXTRA_BODY", "{}")),
+        )
+    return Groq(api_key=os.getenv("GROQ_API_KEY"), timeout=DEFAULT_TIMEOUT, http_client=http_client)
+
+
+# Return the process-wide client of a backend, creating it on first use.
+# The underlying httpx pool keeps connections alive between calls; its size is
+# configured with GROQ_MAX_CONNECTIONS, GROQ_MAX_KEEPALIVE and GROQ_KEEPALIVE_EXPIRY.
+# With LLM_API_BASE set (e.g. http://localhost:8080/v1), remote requests go to that OpenAI-compatible
+# server instead of Groq; LLM_EXTRA_BODY adds JSON fields to every request, e.g. '{"cache_prompt": true}'.
+def get_client(backend="remote"):
+    with _client_lock:
+        if backend not in _clients:
+            _clients[backend] = _create_client(backend)
+        return _clients[backend]
+
+
+# Replace the client of a backend (of every backend by default), e.g. with a recorded or mock backend for offline benchmarks
+def set_client(client, backend=None):
+    with _client_lock:
+        for name in BACKENDS if backend is None else (backend,):
+            _clients[name] = client
+
+
+def set_limits(max_concurrency=0, requests_per_minute=0):
+    global _concurrency, _rate_limiter
+    _concurrency = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+    _rate_limiter = RateLimiter(requests_per_minute / 60) if requests_per_minute else None
+
+
+set_limits(int(os.getenv("GROQ_MAX_CONCURRENCY", 0)), float(os.getenv("GROQ_REQUESTS_PER_MINUTE", 0)))
+
+
+# Resolve the model, timeout and backend for a stage from the registry
+def stage_config(stage):
+    config = {"model": DEFAULT_MODEL, "timeout": DEFAULT_TIMEOUT, "backend": "remote"}
+    config.update(STAGE_CONFIG.get(stage, {}))
+    config["backend"] = os.getenv(f"LLM_BACKEND_{stage.upper()}") or os.getenv("LLM_BACKEND") or config["backend"]
+    if config["backend"] not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend for {stage}: {config['backend']}")
+    if config["backend"] == "local" and not LOCAL_API_BASE:
+        config["backend"] = "remote"
+    if config["backend"] == "local":
+        config["model"] = LOCAL_MODEL
+    config["model"] = os.getenv(f"GROQ_MODEL_{stage.upper()}", config["model"])
+    return config
+
+
+# Stream a chat completion for a stage, yielding the text deltas as they arrive.
+# Identical requests (model, messages, temperature, max_tokens) are served from the cache in one piece;
+# refresh=True skips the lookup and replaces the cached answer, e.g. when regenerating invalid output.
+# The answer is only cached once the stream has been consumed to the end.
+# Every call, including cache hits, is recorded by the telemetry module.
+# max_tokens is the stage's cap: with expected_tokens (the expected answer size) it is sized down to fit
+# the answer, and it always leaves the prompt room in the context window (see the tokens module).
+# Calls over the context window or the session's token budget raise a TokenLimitError before they are sent.
+# Remote requests wait for the process-wide concurrency and rate limits (see set_limits).
+def stream_completion(stage, messages, temperature, max_tokens, top_p=1, refresh=False, expected_tokens=None):
+    config = stage_config(stage)
+    # Count the prompt locally and size max_tokens before anything is sent
+    prompt_tokens = tokens.count_messages(messages)
+    max_tokens = tokens.fit_max_tokens(config["model"], prompt_tokens, max_tokens, expected_tokens)
+    call = telemetry.Call(stage, config["model"], messages, prompt_tokens)
+    key = None
+    if cache is not None:
+        key = completion_key(config["model"], messages, temperature, max_tokens, top_p)
+        cached = None if refresh else cache.get(key)
+        if cached is not None:
+            call.first_token()
+            yield cached
+            call.finish(cached, cached=True)
+            return
+
+    tokens.check_budget(prompt_tokens)
+    pieces = []
+    # The process-wide limits protect the remote provider; a local server queues requests itself
+    concurrency = _concurrency if config["backend"] == "remote" else None
+    if concurrency is not None:
+        concurrency.acquire()
+    try:
+        if _rate_limiter is not None and config["backend"] == "remote":
+            _rate_limiter.wait()
+        completion = get_client(config["backend"]).chat.completions.create(
+            model=config["model"],
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stream=True,
+            stop=None,
+            timeout=config["timeout"],
+        )
+        for chunk in completion:
+            # The usage-only last chunk of OpenAI-compatible servers has no choices,
+            # and role-only or finishing chunks may have no content
+            piece = (getattr(chunk.choices[0].delta, "content", None) or "") if chunk.choices else ""
+            if piece:
+                if not pieces:
+                    call.first_token()
+                pieces.append(piece)
+                yield piece
+            # The token usage comes with the last chunk: in x_groq on Groq, in usage (and timings
+            # on llama.cpp) on OpenAI-compatible servers
+            usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+            if usage is not None:
+                call.usage = usage
+            if getattr(chunk, "timings", None) is not None:
+                call.timings = chunk.timings
+    except Exception as e:
+        finished = call.finish("".join(pieces), error=f"{type(e).__name__}: {e}")
+        tokens.spend(finished["prompt_tokens"] + finished["completion_tokens"])
+        raise
+    finally:
+        if concurrency is not None:
+            concurrency.release()
+
+    answer = "".join(pieces)
+    finished = call.finish(answer)
+    tokens.spend(finished["prompt_tokens"] + finished["completion_tokens"])
+    if cache is not None:
+        cache.set(key, answer)
+
+
+# Run a streaming chat completion for a stage and return the concatenated answer
+def chat_completion(stage, messages, temperature, max_tokens, top_p=1, refresh=False, expected_tokens=None):
+    return "".join(stream_completion(stage, messages, temperature, max_tokens, top_p, refresh, expected_tokens))
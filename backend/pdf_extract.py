@@ -0,0 +1,73 @@
+import io
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PyPDF2 import PdfReader
+
+# Documents with fewer pages than this are extracted in-process; the pool start-up costs more than it saves
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 16))
+
+_worker_reader = None
+
+
+# The document cannot be read or has no extractable text
+class DocumentReadError(ValueError):
+    pass
+
+
+# Read the uploaded file (path, bytes or file-like object) into bytes once
+def read_pdf_bytes(pdf_file):
+    if isinstance(pdf_file, bytes):
+        return pdf_file
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as file:
+            return file.read()
+    if hasattr(pdf_file, "seek"):
+        pdf_file.seek(0)
+    return pdf_file.read()
+
+
+# Pool initializer: every worker parses the document once and keeps the reader around
+def _init_worker(pdf_bytes):
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(pdf_bytes))
+
+
+# Extract a single page and time it
+def _extract_page(reader, index):
+    start = time.perf_counter()
+    text = reader.pages[index].extract_text() or ""
+    return index, text, time.perf_counter() - start
+
+
+def _extract_page_in_worker(index):
+    return _extract_page(_worker_reader, index)
+
+
+# Yield (page_index, text, seconds) for every page of the PDF, in page order.
+# Large documents are extracted on a process pool; at most max_pending pages are
+# in flight at once so memory stays bounded regardless of the page count.
+def iter_pdf_pages(pdf_file, workers=None, max_pending=None):
+    pdf_bytes = read_pdf_bytes(pdf_file)
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    page_count = len(reader.pages)
+
+    if page_count < PARALLEL_MIN_PAGES:
+        for index in range(page_count):
+            yield _extract_page(reader, index)
+        return
+
+    workers = workers or int(os.getenv("PDF_WORKERS", 0)) or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    # The Streamlit and Flask servers are multi-threaded, so the workers must not be forked from them
+    context = multiprocessing.get_context(os.getenv("PDF_START_METHOD", "spawn"))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pdf_bytes,), mp_context=context) as executor:
+        pending = deque()
+        next_index = 0
+        while next_index < page_count or pending:
+            while next_index < page_count and len(pending) < max_pending:
+                pending.append(executor.submit(_extract_page_in_worker, next_index))
+                next_index += 1
+            yield pending.popleft().result()
@@ -0,0 +1,61 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# Run a single stage and measure how long it took
+def timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# Run a set of stages as a dependency DAG.
+# stages maps a stage name to (function, [dependency names]); each function is
+# called with the results of its dependencies, in the order they are listed.
+# Returns (results, timings) where timings holds the seconds spent per stage
+# plus the wall-clock "total" for the whole run.
+# Stages already in results (e.g. restored from a checkpoint) are not run again;
+# on_result(name, result) is called as each remaining stage finishes.
+def run_stages(stages, parallel=True, max_workers=4, results=None, on_result=None):
+    results = dict(results or {})
+    timings = {}
+    pending = {name: stage for name, stage in stages.items() if name not in results}
+    start = time.perf_counter()
+
+    if not parallel:
+        # Sequential mode: run every stage as soon as its dependencies are done
+        while pending:
+            ready = [name for name, (func, deps) in pending.items() if all(dep in results for dep in deps)]
+            if not ready:
+                raise ValueError(f"Unresolvable stage dependencies: {sorted(pending)}")
+            for name in ready:
+                func, deps = pending.pop(name)
+                results[name], timings[name] = timed_call(func, *[results[dep] for dep in deps])
+                if on_result is not None:
+                    on_result(name, results[name])
+        timings["total"] = time.perf_counter() - start
+        return results, timings
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Submit every stage whose dependencies have finished, in a copy of the caller's context
+            # so the stage's LLM calls keep the caller's telemetry session
+            for name, (func, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    future = executor.submit(contextvars.copy_context().run, timed_call, func, *[results[dep] for dep in deps])
+                    running[future] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Unresolvable stage dependencies: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+                if on_result is not None:
+                    on_result(name, results[name])
+
+    timings["total"] = time.perf_counter() - start
+    return results, timings
@@ -0,0 +1,240 @@
+import contextvars
+import copy
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from chunking import merge_answer, parse_json_output
+from retrieval import tokenize
+from dedup import content_words
+
+# Answers up to this long that map to a single field are written as they are, without an LLM call
+DIRECT_ANSWER_MAX_CHARS = int(os.getenv("REFILL_DIRECT_MAX_CHARS", 80))
+# ... and only when at least this share of the question's words appear in the field
+DIRECT_MATCH_MIN_COVERAGE = float(os.getenv("REFILL_DIRECT_MIN_COVERAGE", 0.75))
+REFILL_WORKERS = int(os.getenv("REFILL_WORKERS", 4))
+# Background workers shared by the speculative refills of all sessions
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", 2))
+# At most this many fields are re-filled per answer
+FIELDS_PER_ANSWER = 3
+
+
+# Format a path of keys and list indexes as a JSON Pointer (RFC 6901)
+def json_pointer(parts):
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in parts)
+
+
+def _pointer_parts(pointer):
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer.split("/")[1:]]
+
+
+# Apply "replace"/"add" operations of a JSON Patch (RFC 6902) to a copy of data
+def apply_patch(data, ops):
+    data = copy.deepcopy(data)
+    for op in ops:
+        if op["op"] not in ("replace", "add"):
+            raise ValueError(f"Unsupported patch operation: {op['op']}")
+        parts = _pointer_parts(op["path"])
+        target = data
+        for part in parts[:-1]:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        if isinstance(target, list):
+            target[int(parts[-1])] = op["value"]
+        else:
+            target[parts[-1]] = op["value"]
+    return data
+
+
+# Every object with a "User Answer" in markers, as (pointer, field) pairs in document order
+def open_fields(data, markers=("TBD", "")):
+    fields = []
+    stack = [(data, ())]
+    while stack:
+        value, path = stack.pop()
+        if isinstance(value, dict):
+            if "User Answer" in value and str(value["User Answer"]).strip().upper() in markers:
+                fields.append((json_pointer(path), value))
+            stack.extend((child, path + (key,)) for key, child in reversed(list(value.items())))
+        elif isinstance(value, list):
+            stack.extend((child, path + (index,)) for index, child in reversed(list(enumerate(value))))
+    return fields
+
+
+def field_text(pointer, field):
+    return pointer + " " + " ".join(str(value) for key, value in field.items() if key != "User Answer")
+
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+# Share of the question's words (without the question phrasing) that appear in the field
+def match_coverage(question, pointer, field):
+    words = {_stem(word) for word in content_words(question)}
+    if not words:
+        return 0
+    return len(words & {_stem(word) for word in tokenize(field_text(pointer, field))}) / len(words)
+
+
+# Pick the fields a question is about by word overlap with the field path and description
+def match_fields(question, fields, top_k=FIELDS_PER_ANSWER):
+    question_tokens = set(tokenize(question))
+    scores = []
+    for pointer, field in fields:
+        field_tokens = set(tokenize(field_text(pointer, field)))
+        overlap = len(question_tokens & field_tokens)
+        scores.append(overlap / math.sqrt(len(field_tokens)) if field_tokens else 0)
+    best = max(scores, default=0)
+    if best == 0:
+        return []
+    ranked = sorted(range(len(fields)), key=lambda index: -scores[index])[:top_k]
+    return [fields[index] for index in ranked if scores[index] >= best / 2]
+
+
+# Validate the {pointer: answer} object a field fill returns
+def parse_field_answers(output, pointers):
+    answers = parse_json_output(output)
+    if not isinstance(answers, dict):
+        raise ValueError("Expected a JSON object mapping field paths to answers")
+    return {pointer: value for pointer, value in answers.items() if pointer in pointers}
+
+
+# Build the merged JSON the full refill used to return: the BizObj template with the observations added
+def merge_templates(obs, bizobj):
+    if isinstance(bizobj, dict):
+        return dict(bizobj, Observations=obs)
+    return {"BizObj": bizobj, "Observations": obs}
+
+
+# Pair the answers with the questions they answer. With more answers than questions
+# (earlier rounds in the chat history), the last answers belong to the questions.
+def answer_pairs(questions, answers):
+    count = min(len(questions), len(answers))
+    return list(zip(questions[len(questions) - count:], answers[len(answers) - count:]))
+
+
+# The targets of the questions that answer_pairs kept (the last ones)
+def pair_targets(questions, pairs, targets):
+    if targets is None:
+        return None
+    return targets[len(questions) - len(pairs):len(questions)]
+
+
+# Split the refill for question-answer pairs into direct writes {pointer: [answer, ...]} and
+# fill jobs (question, answer, {pointer: field}). Short answers to a question that clearly names
+# a single field are written directly; answers that match no field are re-filled against all open
+# fields (the fill only returns the fields it fills).
+# targets, when given, holds the pointer each question was asked for (one per pair, e.g. the
+# conflict questions); such a question only fills that field, without matching.
+def plan_refill(pairs, fields, targets=None):
+    open_by_pointer = dict(fields)
+    filled = {}
+    jobs = []
+    for (question, answer), target in zip(pairs, targets or [None] * len(pairs)):
+        if target is not None:
+            matched = [(target, open_by_pointer[target])] if target in open_by_pointer else []
+        else:
+            matched = match_fields(question, fields) or fields
+        if not matched:
+            continue
+        if (
+            len(matched) == 1
+            and len(answer) <= DIRECT_ANSWER_MAX_CHARS
+            and "\n" not in answer
+            and (target is not None or match_coverage(question, *matched[0]) >= DIRECT_MATCH_MIN_COVERAGE)
+        ):
+            filled.setdefault(matched[0][0], []).append(answer)
+        else:
+            jobs.append((question, answer, dict(matched)))
+    return filled, jobs
+
+
+# Fill only the fields touched by each answer and return the patched data.
+# fill(question, answer, fields) -> {pointer: answer} re-fills the given {pointer: field} subset.
+# With resolve=True new answers replace the old ones (conflict resolution), otherwise a second,
+# different answer for a field marks it as CONFLICT. targets are the pointers the questions were
+# asked for, one per question (see plan_refill).
+def incremental_refill(questions, answers, data, fill, markers=("TBD", ""), resolve=False, workers=REFILL_WORKERS, targets=None):
+    pairs = answer_pairs(questions, answers)
+    filled, jobs = plan_refill(pairs, open_fields(data, markers), pair_targets(questions, pairs, targets))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Jobs run in a copy of the caller's context, so their LLM calls keep the caller's telemetry session
+        futures = [executor.submit(contextvars.copy_context().run, fill, *job) for job in jobs]
+        results = [future.result() for future in futures]
+    for result in results:
+        for pointer, value in result.items():
+            filled.setdefault(pointer, []).append(value)
+
+    ops = []
+    for pointer, values in filled.items():
+        value = values[-1] if resolve else values[0]
+        if not resolve:
+            for other in values[1:]:
+                value = merge_answer(value, other)
+        if value in ("", "TBD", None):
+            continue
+        ops.append({"op": "replace", "path": pointer + "/User Answer", "value": value})
+    return apply_patch(data, ops)
+
+
+speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS)
+
+
+# Runs the fill jobs of the answers given so far in the background while the user answers the
+# next question. update() is called after every answer; at the end of the questionnaire
+# incremental_refill is given fill() and only waits for the jobs that are not done yet.
+# Jobs are keyed by question, answer and fields, so a job is never run twice.
+class SpeculativeRefill:
+    def __init__(self, fill, executor=speculative_executor):
+        self._fill = fill
+        self.executor = executor
+        self.futures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(question, answer, fields):
+        return question, answer, json.dumps(fields, sort_keys=True, ensure_ascii=False)
+
+    # Start the fill jobs for the pairs answered so far; returns how many jobs were started
+    def update(self, questions, answers, data, markers=("TBD", ""), targets=None):
+        pairs = answer_pairs(questions, answers)
+        _, jobs = plan_refill(pairs, open_fields(data, markers), pair_targets(questions, pairs, targets))
+        started = 0
+        with self._lock:
+            for job in jobs:
+                key = self._key(*job)
+                if key not in self.futures:
+                    self.futures[key] = self.executor.submit(contextvars.copy_context().run, self._fill, *job)
+                    started += 1
+        return started
+
+    # The speculative result for a job if there is one, otherwise a fresh fill.
+    # A job still queued behind other sessions' jobs is cancelled and run here instead of waited for.
+    def fill(self, question, answer, fields):
+        with self._lock:
+            future = self.futures.get(self._key(question, answer, fields))
+        if future is not None and not future.cancel():
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Speculative refill failed, filling again: {e}")
+        return self._fill(question, answer, fields)
+
+    def clear(self):
+        with self._lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+
+
+# Parse a filled template that may still be a JSON string
+def load_json(value):
+    if isinstance(value, str):
+        return parse_json_output(value)
+    return value
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, indent=2)
@@ -0,0 +1,100 @@
+import os
+import re
+import numpy as np
+from scipy import sparse
+from chunking import split_text
+
+# Documents shorter than this are sent whole; retrieval only pays off on long texts
+RETRIEVAL_MIN_CHARS = int(os.getenv("RETRIEVAL_MIN_CHARS", 12000))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+PASSAGE_CHARS = int(os.getenv("RETRIEVAL_PASSAGE_CHARS", 1000))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "if", "in", "is", "it", "of",
+    "on", "or", "that", "the", "this", "to", "was", "were", "which", "with", "will", "etc",
+}
+# Template keys whose values describe the schema rather than the document
+IGNORED_KEYS = {"type", "User Answer", "$schema", "required"}
+
+
+def tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+
+# Collect the field names and descriptions of a template part into a retrieval query
+def template_query(template):
+    if isinstance(template, str):
+        return template
+    words = []
+    if isinstance(template, dict):
+        for key, value in template.items():
+            if key in IGNORED_KEYS:
+                continue
+            words.append(str(key))
+            words.append(template_query(value))
+    elif isinstance(template, list):
+        words.extend(template_query(item) for item in template)
+    else:
+        words.append(str(template))
+    return " ".join(word for word in words if word)
+
+
+# BM25 index over fixed-size passages of a document.
+# Passage term weights are precomputed into a sparse matrix, so a query is one sparse product.
+class PassageIndex:
+    def __init__(self, text, passage_chars=PASSAGE_CHARS, k1=1.5, b=0.75):
+        self.passages = split_text(text, passage_chars, overlap=passage_chars // 10) if text else []
+        self.vocabulary = {}
+        rows, cols, counts = [], [], []
+        lengths = []
+        for row, passage in enumerate(self.passages):
+            tokens = tokenize(passage)
+            lengths.append(len(tokens))
+            term_counts = {}
+            for token in tokens:
+                column = self.vocabulary.setdefault(token, len(self.vocabulary))
+                term_counts[column] = term_counts.get(column, 0) + 1
+            for column, count in term_counts.items():
+                rows.append(row)
+                cols.append(column)
+                counts.append(count)
+
+        shape = (len(self.passages), len(self.vocabulary))
+        tf = sparse.csr_matrix((np.array(counts, dtype=np.float64), (rows, cols)), shape=shape)
+        lengths = np.array(lengths, dtype=np.float64)
+        average_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+
+        document_frequency = np.bincount(tf.indices, minlength=shape[1])
+        idf = np.log(1 + (shape[0] - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        # BM25 weight for every non-zero (passage, term) entry
+        norms = k1 * (1 - b + b * lengths / average_length)
+        row_norms = np.repeat(norms, np.diff(tf.indptr))
+        weights = tf.data * (k1 + 1) / (tf.data + row_norms) * idf[tf.indices]
+        self.weights = sparse.csr_matrix((weights, tf.indices, tf.indptr), shape=shape)
+
+    # Return the top_k passages that best match the query, in document order
+    def search(self, query, top_k=RETRIEVAL_TOP_K):
+        columns = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not columns or not self.passages:
+            return self.passages[:top_k]
+        query_vector = np.zeros(len(self.vocabulary))
+        query_vector[columns] = 1.0
+        scores = self.weights @ query_vector
+        best = np.argsort(-scores, kind="stable")[:top_k]
+        return [self.passages[row] for row in sorted(best)]
+
+    # Relevant passages joined into a single text for a prompt
+    def context(self, query, top_k=RETRIEVAL_TOP_K):
+        return "\n...\n".join(self.search(query, top_k))
+
+    # Relevant passages for the fields and descriptions of a template part
+    def template_context(self, template, top_k=RETRIEVAL_TOP_K):
+        return self.context(template_query(template), top_k)
+
+
+# Build an index for the document, or None when the text is short enough to send whole
+def build_index(text):
+    if len(text) < RETRIEVAL_MIN_CHARS:
+        return None
+    return PassageIndex(text)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Persistent key/value stores for session state and per-document pipeline checkpoints,
+# so a browser refresh, a second tab or a restarted worker resumes instead of re-running
+# the LLM chain. Values are JSON-serializable objects.
+# SESSION_STORE selects the backend: "sqlite" (default), "file", "redis" or "none".
+
+
+def document_key(pdf_bytes, *versions):
+    digest = hashlib.sha256(pdf_bytes)
+    for version in versions:
+        digest.update(str(version).encode("utf-8"))
+    return "doc:" + digest.hexdigest()
+
+
+def session_key(session_id):
+    return "session:" + str(session_id)
+
+
+class SQLiteStore:
+    def __init__(self, path="sessions.sqlite3", ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def get(self, key):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, updated FROM sessions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, updated = row
+            if self.ttl is not None and time.time() - updated > self.ttl:
+                self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+                return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (key, value, updated) VALUES (?, ?, ?)", (key, data, time.time())
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+
+# One JSON file per key; files are replaced atomically
+class FileStore:
+    def __init__(self, directory="sessions", ttl=None):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(value, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+# Any Redis-compatible server; the redis package is only needed when this store is used
+class RedisStore:
+    def __init__(self, url="redis://localhost:6379/0", ttl=None, prefix="qualitas:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=int(self.ttl) if self.ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+# Open the store configured with SESSION_STORE, SESSION_STORE_PATH/SESSION_STORE_URL and SESSION_TTL
+def open_store(kind=None):
+    kind = kind or os.getenv("SESSION_STORE", "sqlite")
+    ttl = float(os.getenv("SESSION_TTL", 7 * 24 * 3600)) or None
+    if kind == "none":
+        return None
+    if kind == "sqlite":
+        return SQLiteStore(os.getenv("SESSION_STORE_PATH", "sessions.sqlite3"), ttl)
+    if kind == "file":
+        return FileStore(os.getenv("SESSION_STORE_PATH", "sessions"), ttl)
+    if kind == "redis":
+        return RedisStore(os.getenv("SESSION_STORE_URL", "redis://localhost:6379/0"), ttl)
+    raise ValueError(f"Unknown SESSION_STORE: {kind}")
@@ -0,0 +1,74 @@
+import ast
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+MAX_ATTEMPTS = int(os.getenv("STRUCTURED_MAX_ATTEMPTS", 3))
+BACKOFF_SECONDS = float(os.getenv("STRUCTURED_BACKOFF", 1))
+
+# Parse failures and regenerations per stage, shown next to the stage timings
+metrics = {"parse_failures": Counter(), "retries": Counter()}
+_metrics_lock = threading.Lock()
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+# Validate a Python/JSON list of non-empty strings, e.g. a question array or the classification labels
+def parse_string_list(output):
+    output = output.strip()
+    start, end = output.find("["), output.rfind("]")
+    if start == -1 or end < start:
+        raise ValueError("No question array found in the output")
+    try:
+        questions = json.loads(output[start:end + 1])
+    except json.JSONDecodeError:
+        questions = ast.literal_eval(output[start:end + 1])
+    if not isinstance(questions, list) or not all(isinstance(question, str) and question.strip() for question in questions):
+        raise ValueError("The array must only contain non-empty strings")
+    return questions
+
+
+def parse_question_list(output):
+    return parse_string_list(output)
+
+
+# Validate a JSON object with a non-empty question for each of the given field pointers;
+# returns the questions in the order of the pointers
+def parse_question_map(output, pointers):
+    output = output.strip()
+    start, end = output.find("{"), output.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("No question object found in the output")
+    questions = json.loads(output[start:end + 1])
+    if not isinstance(questions, dict):
+        raise ValueError("Expected a JSON object mapping field paths to questions")
+    missing = [pointer for pointer in pointers if not isinstance(questions.get(pointer), str) or not questions[pointer].strip()]
+    if missing:
+        raise ValueError(f"No question for {missing}")
+    return [questions[pointer] for pointer in pointers]
+
+
+def record(name, stage):
+    with _metrics_lock:
+        metrics[name][stage] += 1
+
+
+# Call generate(attempt) until validate accepts its output, at most max_attempts times.
+# Only the failed call is regenerated, with exponential backoff between attempts;
+# generate should bypass the completion cache when attempt > 0.
+def generate_validated(stage, generate, validate, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF_SECONDS):
+    for attempt in range(max_attempts):
+        if attempt > 0:
+            record("retries", stage)
+            time.sleep(backoff * 2 ** (attempt - 1))
+        output = generate(attempt)
+        try:
+            return validate(output)
+        except (ValueError, SyntaxError) as e:
+            record("parse_failures", stage)
+            print(f"Invalid output from {stage} (attempt {attempt + 1}/{max_attempts}): {e}")
+    raise StructuredOutputError(f"{stage} did not return valid output after {max_attempts} attempts")
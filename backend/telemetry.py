@@ -0,0 +1,205 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Per-call telemetry for every LLM completion: stage, model, prompt size, time to first token,
+# duration, token counts (including prompt tokens served from the backend's prompt cache) and
+# estimated cost. Aggregates are exported as OpenMetrics text (metrics_text()) and every call
+# is appended to a per-session NDJSON trace file.
+
+# Directory of the per-session trace files; set LLM_TRACE_DIR= (empty) to disable them
+TRACE_DIR = os.getenv("LLM_TRACE_DIR", "traces")
+# Used when the provider does not report token usage
+CHARS_PER_TOKEN = 4
+# Estimated USD per million (prompt, completion) tokens; override with LLM_PRICES='{"model": [in, out]}'
+PRICES = {
+    "llama-3.1-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+}
+PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+# Upper bounds (seconds) of the duration and time-to-first-token histograms
+BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+_session = contextvars.ContextVar("llm_session", default="default")
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+def current_session():
+    return _session.get()
+
+
+# Attribute the LLM calls made inside the block (and in worker threads started from it
+# with contextvars.copy_context()) to a session
+@contextmanager
+def session(session_id):
+    token = _session.set(str(session_id))
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def _safe_name(session_id):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", session_id) or "default"
+
+
+def trace_path(session_id):
+    return os.path.join(TRACE_DIR, _safe_name(session_id) + ".ndjson")
+
+
+def _observe(name, labels, value):
+    histogram = _histograms.setdefault((name, labels), [0] * len(BUCKETS) + [0, 0.0])
+    for index, bound in enumerate(BUCKETS):
+        if value <= bound:
+            histogram[index] += 1
+    histogram[-2] += 1
+    histogram[-1] += value
+
+
+# Prompt tokens the backend served from its prompt/KV cache: usage.prompt_tokens_details.cached_tokens
+# on Groq and OpenAI-compatible servers, timings.cache_n on llama.cpp
+def cached_tokens(usage, timings=None):
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        cached = getattr(timings, "cache_n", None)
+    return cached or 0
+
+
+# Measures one completion. The streaming loop only calls first_token() once and finish() at the end.
+class Call:
+    def __init__(self, stage, model, messages, prompt_tokens=None):
+        self.stage = stage
+        self.model = model
+        self.session = current_session()
+        self.prompt_chars = sum(len(message["content"]) for message in messages)
+        # Local count of the prompt tokens, used when the provider does not report usage
+        self.prompt_tokens = prompt_tokens
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.ttft = None
+        self.usage = None
+        self.timings = None
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+
+    def finish(self, output="", cached=False, error=None):
+        duration = time.perf_counter() - self.start
+        prompt_tokens = getattr(self.usage, "prompt_tokens", None) or self.prompt_tokens or self.prompt_chars // CHARS_PER_TOKEN
+        completion_tokens = getattr(self.usage, "completion_tokens", None) or estimate_tokens(output)
+        cached_prompt_tokens = cached_tokens(self.usage, self.timings)
+        cost = 0.0 if cached else estimate_cost(self.model, prompt_tokens, completion_tokens)
+        call = {
+            "session": self.session,
+            "stage": self.stage,
+            "model": self.model,
+            "start": self.start_time,
+            "prompt_chars": self.prompt_chars,
+            "prompt_tokens": prompt_tokens,
+            "cached_prompt_tokens": cached_prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "ttft": self.ttft,
+            "duration": duration,
+            "cost": cost,
+            "cached": cached,
+            "error": error,
+        }
+        record(call)
+        return call
+
+
+# Add a finished call to the aggregates and to its session's trace file
+def record(call):
+    labels = (("stage", call["stage"]), ("model", call["model"]))
+    with _lock:
+        if call["cached"]:
+            _counters[("llm_cache_hits", labels)] += 1
+        else:
+            _counters[("llm_calls", labels)] += 1
+            _counters[("llm_prompt_tokens", labels)] += call["prompt_tokens"]
+            _counters[("llm_cached_prompt_tokens", labels)] += call["cached_prompt_tokens"]
+            _counters[("llm_completion_tokens", labels)] += call["completion_tokens"]
+            _counters[("llm_cost_usd", labels)] += call["cost"]
+            _observe("llm_duration_seconds", labels, call["duration"])
+            if call["ttft"] is not None:
+                _observe("llm_ttft_seconds", labels, call["ttft"])
+        if call["error"]:
+            _counters[("llm_errors", labels)] += 1
+        if TRACE_DIR:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(trace_path(call["session"]), "a", encoding="utf-8") as file:
+                file.write(json.dumps(call) + "\n")
+
+
+def read_trace(session_id):
+    path = trace_path(session_id)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# Totals per stage for one session, from its trace file
+def session_summary(session_id):
+    summary = {}
+    for call in read_trace(session_id):
+        stage = summary.setdefault(call["stage"], {"calls": 0, "cache_hits": 0, "seconds": 0.0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+        if call["cached"]:
+            stage["cache_hits"] += 1
+            continue
+        stage["calls"] += 1
+        stage["seconds"] += call["duration"]
+        stage["prompt_tokens"] += call["prompt_tokens"]
+        stage["cached_prompt_tokens"] += call.get("cached_prompt_tokens", 0)
+        stage["completion_tokens"] += call["completion_tokens"]
+        stage["cost"] += call["cost"]
+    return summary
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+# Export the aggregates in the OpenMetrics text format
+def metrics_text():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+    lines = []
+    for name in ("llm_calls", "llm_cache_hits", "llm_errors", "llm_prompt_tokens", "llm_cached_prompt_tokens", "llm_completion_tokens", "llm_cost_usd"):
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}_total{_labels(labels)} {value:.12g}")
+    for name in ("llm_duration_seconds", "llm_ttft_seconds"):
+        lines.append(f"# TYPE {name} histogram")
+        lines.append(f"# UNIT {name} seconds")
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(BUCKETS, values):
+                lines.append(f"{name}_bucket{_labels(labels, [('le', float(bound))])} {count}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_sum{_labels(labels)} {values[-1]:.12g}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,97 @@
+import json
+import os
+from structured import parse_string_list
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OBS_JSON_PATH = os.path.join(BASE_DIR, "observationsJSON.json")
+# BizObjJSON.json is used when present, otherwise the overall schema it is derived from
+BIZOBJ_JSON_PATH = os.path.join(BASE_DIR, "BizObjJSON.json")
+if not os.path.exists(BIZOBJ_JSON_PATH):
+    BIZOBJ_JSON_PATH = os.path.join(BASE_DIR, "overall_schema.json")
+
+# The choices offered by classification_LLM, in prompt order
+CLASSIFICATION_CHOICES = [
+    "2D Measurement",
+    "Anomaly Detection",
+    "Print Defect",
+    "Counting",
+    "3D Measurement",
+    "Presence/Absence",
+    "OCR",
+    "Code Reading",
+    "Mismatch Detection",
+    "Classification",
+    "Assembly Verification",
+    "Color Verification",
+]
+
+
+# Serialize a template as compact JSON for a prompt; strings are passed through unchanged
+def minify(template):
+    if isinstance(template, str):
+        return template
+    return json.dumps(template, separators=(",", ":"), ensure_ascii=False)
+
+
+def load_template(path):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def validate_observations(template):
+    if not isinstance(template, list):
+        raise ValueError(f"{OBS_JSON_PATH} must contain a list of observations")
+    for item in template:
+        if not isinstance(item, dict) or "Observation Type" not in item or "User Answer" not in item:
+            raise ValueError(f"Invalid observation in {OBS_JSON_PATH}: {item}")
+    return template
+
+
+def validate_bizobj(template):
+    if not isinstance(template, dict) or not template:
+        raise ValueError(f"{BIZOBJ_JSON_PATH} must contain a JSON object")
+    return template
+
+
+# An observation type belongs to a choice when it is the choice itself or a qualified form of it,
+# e.g. "OCR (Optical Character Recognition)" for "OCR"
+def matches_choice(observation_type, choice):
+    return observation_type == choice or observation_type.startswith(choice + " ")
+
+
+# Templates are loaded, validated and minified once when the module is imported
+obs_template = validate_observations(load_template(OBS_JSON_PATH))
+bizobj_template = validate_bizobj(load_template(BIZOBJ_JSON_PATH))
+obs_template_json = minify(obs_template)
+bizobj_template_json = minify(bizobj_template)
+
+# The observationsJSON subset for every classification choice
+obs_by_choice = {
+    choice: [item for item in obs_template if matches_choice(item["Observation Type"], choice)]
+    for choice in CLASSIFICATION_CHOICES
+}
+
+
+# The choices in the label array of a classification_LLM answer, in prompt order.
+# Labels must match a choice exactly (ignoring case); an answer without a label array names no choice.
+def classification_choices(classification):
+    try:
+        labels = {label.strip().lower() for label in parse_string_list(classification)}
+    except (ValueError, SyntaxError):
+        return []
+    return [choice for choice in CLASSIFICATION_CHOICES if choice.lower() in labels]
+
+
+# The observations matching a classification_LLM answer, in template order.
+# Returns an empty list when the answer names none of the known choices.
+def observations_for(classification):
+    choices = classification_choices(classification)
+    return [item for item in obs_template if any(item in obs_by_choice[choice] for choice in choices)]
+
+
+# Split observations into groups of the same "Observation Type", in template order
+def group_observations(observations):
+    groups = {}
+    for item in observations:
+        groups.setdefault(item["Observation Type"], []).append(item)
+    return list(groups.values())
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The backend modules import each other by name, as when the app is started from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# No completion cache, traces, session store or network access in the tests
+os.environ["LLM_CACHE"] = "0"
+os.environ["LLM_TRACE_DIR"] = ""
+os.environ["SESSION_STORE"] = "none"
+os.environ.setdefault("GROQ_API_KEY", "test")
@@ -0,0 +1,97 @@
+import json
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from airtable import AirtableWriter, retry_delay
+
+
+# Local stand-in for the Airtable API: answers each request with the next scripted
+# (status, headers) response, then 200, and records every request it gets
+class MockAirtable(ThreadingHTTPServer):
+    def __init__(self, responses):
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.responses = list(responses)
+        self.requests = []
+        self.lock = threading.Lock()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def _handle(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, body))
+            status, headers = self.server.responses.pop(0) if self.server.responses else (200, {})
+        response = json.dumps({"records": body["records"]} if status == 200 else {"error": "scripted"}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_POST = do_PATCH = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def airtable():
+    servers = []
+
+    def start(*responses):
+        server = MockAirtable(responses)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def writer(server, **kwargs):
+    url = f"http://127.0.0.1:{server.server_address[1]}/v0"
+    return AirtableWriter("key", "base", "table", api_url=url, max_workers=1, rate=1000, backoff=0, **kwargs)
+
+
+RECORDS = [{"Category": "BIZ_OBJ", "User Answer": str(index)} for index in range(15)]
+
+
+def test_rate_limited_batch_is_retried_after_an_http_date(airtable):
+    server = airtable((429, {"Retry-After": formatdate(usegmt=True)}))
+    assert writer(server).write(RECORDS) == {"written": 15, "failed": []}
+    assert len(server.requests) == 3
+
+
+def test_server_errors_are_retried(airtable):
+    server = airtable((503, {}), (500, {"Retry-After": "0"}))
+    assert writer(server).write(RECORDS[:10]) == {"written": 10, "failed": []}
+    assert len(server.requests) == 3
+
+
+# A rejected batch is reported without retries and does not stop the other batches
+def test_invalid_batch_fails_alone(airtable):
+    server = airtable((422, {}))
+    result = writer(server).write(RECORDS)
+    assert result["written"] == 5
+    assert [(failure["status"], len(failure["records"])) for failure in result["failed"]] == [(422, 10)]
+    assert len(server.requests) == 2
+
+
+def test_upsert(airtable):
+    server = airtable()
+    assert writer(server, upsert_fields=["Category"]).write(RECORDS[:3])["written"] == 3
+    method, path, body = server.requests[0]
+    assert (method, path) == ("PATCH", "/v0/base/table")
+    assert body["performUpsert"] == {"fieldsToMergeOn": ["Category"]}
+    assert [record["fields"] for record in body["records"]] == RECORDS[:3]
+
+
+def test_retry_delay():
+    assert retry_delay("2") == 2
+    assert retry_delay(formatdate(usegmt=True)) <= 1
+    assert retry_delay("soon") is None
+    assert retry_delay(None) is None
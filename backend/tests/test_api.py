@@ -0,0 +1,72 @@
+import io
+import api
+
+RESULT = {
+    "text": "text",
+    "classification_result": "[]",
+    "obs": "[]",
+    "bizobj": "{}",
+    "questions": ["What is the budget?", "When is the delivery?"],
+    "stage_timings": {},
+    "document_key": "doc:test",
+}
+
+
+def upload(client):
+    return client.post("/api/process_document", data={"file": (io.BytesIO(b"%PDF"), "rfq.pdf")}).get_json()
+
+
+def test_uploads_without_session_id_get_their_own_session(monkeypatch):
+    monkeypatch.setattr(api, "run_document_pipeline", lambda pdf_bytes: dict(RESULT))
+    client = api.app.test_client()
+    first, second = upload(client), upload(client)
+    assert first["session_id"] != second["session_id"]
+    response = client.post("/api/show_question", json={"answer": None}, headers={"X-Session-ID": first["session_id"]})
+    assert response.get_json()["status"] == "question"
+    assert client.post("/api/show_question", json={"answer": None}).status_code == 400
+
+
+# Conflicts found in additional text after the questionnaire was completed reopen it
+def test_conflicts_reopen_a_completed_questionnaire(monkeypatch):
+    monkeypatch.setattr(api, "run_document_pipeline", lambda pdf_bytes: dict(RESULT))
+    monkeypatch.setattr(
+        api, "complete_questionnaire",
+        lambda *args, **kwargs: ("conflicts", ["Which budget is right?", "Which date is right?"], "{}"),
+    )
+    client = api.app.test_client()
+    session_id = upload(client)["session_id"]
+    api.get_session(session_id)["questionnaire_complete"] = True
+    headers = {"X-Session-ID": session_id}
+
+    response = client.post("/api/process_additional_text", json={"text": "The budget is 10k"}, headers=headers)
+    assert response.get_json()["status"] == "conflicts_detected"
+    response = client.post("/api/show_question", json={"answer": "20k"}, headers=headers)
+    assert response.get_json() == {"status": "question", "question": "Which date is right?", "session_id": session_id}
+
+
+def test_speculation_is_dropped_after_the_questionnaire(monkeypatch):
+    monkeypatch.setattr(api, "run_document_pipeline", lambda pdf_bytes: dict(RESULT))
+    monkeypatch.setattr(api, "complete_questionnaire", lambda *args, **kwargs: ("complete", "Summary", "{}"))
+    client = api.app.test_client()
+    session_id = upload(client)["session_id"]
+    headers = {"X-Session-ID": session_id}
+    client.post("/api/show_question", json={"answer": None}, headers=headers)
+    assert session_id in api.speculations
+    response = client.post("/api/show_question", json={"answer": "Next week"}, headers=headers)
+    assert response.get_json()["status"] == "complete"
+    assert session_id not in api.speculations
+
+
+# Idle sessions and their background refills are dropped from memory; the extracted text is never kept
+def test_idle_sessions_are_evicted(monkeypatch):
+    monkeypatch.setattr(api, "run_document_pipeline", lambda pdf_bytes: dict(RESULT))
+    client = api.app.test_client()
+    idle = upload(client)["session_id"]
+    client.post("/api/show_question", json={"answer": None}, headers={"X-Session-ID": idle})
+    assert idle in api.speculations
+    assert "text" not in api.sessions[idle]
+
+    api.session_used[idle] -= api.SESSION_TTL + 1
+    active = upload(client)["session_id"]
+    assert idle not in api.sessions and idle not in api.speculations and idle not in api.session_used
+    assert active in api.sessions
@@ -0,0 +1,53 @@
+import json
+import httpx
+import llm
+from backends import OpenAICompatibleClient
+
+# Chunks as llama.cpp/vLLM/OpenAI stream them: a role-only first chunk, content,
+# an empty-delta finishing chunk and a usage-only last chunk
+CHUNKS = [
+    {"choices": [{"index": 0, "delta": {"role": "assistant"}}]},
+    {"choices": [{"index": 0, "delta": {"content": "Hello"}}]},
+    {"choices": [{"index": 0, "delta": {"content": " world"}}]},
+    {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+    {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 2}},
+]
+
+
+def sse_client(requests):
+    def handler(request):
+        requests.append(json.loads(request.content))
+        body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in CHUNKS) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+    http = httpx.Client(transport=httpx.MockTransport(handler))
+    return OpenAICompatibleClient("http://llm.test/v1", api_key="key", http_client=http, extra_body={"cache_prompt": True})
+
+
+def test_every_choice_has_content():
+    chunks = list(sse_client([]).create(model="m", messages=[], temperature=0, max_tokens=10))
+    assert [chunk.choices[0].delta.content for chunk in chunks if chunk.choices] == [None, "Hello", " world", None]
+    assert chunks[-1].usage.prompt_tokens == 12
+
+
+def test_stream_completion_over_openai_compatible_server():
+    requests = []
+    llm.set_client(sse_client(requests))
+    try:
+        answer = llm.chat_completion("question_create", [{"role": "user", "content": "Hi"}], temperature=0, max_tokens=64)
+    finally:
+        llm._clients.clear()
+    assert answer == "Hello world"
+    assert requests[0]["cache_prompt"] is True
+    assert requests[0]["stream_options"] == {"include_usage": True}
+
+
+# Recording a stream with role-only, empty-delta and usage-only chunks keeps just the text
+def test_recording_client_skips_chunks_without_content():
+    from benchmark import RecordingClient
+
+    recorded = {}
+    client = RecordingClient(sse_client([]), recorded)
+    chunks = list(client.chat.completions.create(model="m", messages=[], temperature=0, max_tokens=10))
+    assert len(chunks) == len(CHUNKS)
+    assert list(recorded.values()) == ["Hello world"]
@@ -0,0 +1,97 @@
+import json
+import pytest
+from chunking import merge_answer, merge_partials, split_template, split_text, chunked_fill
+
+
+@pytest.mark.parametrize("empty", ["", "TBD", None])
+def test_an_answer_beats_an_empty_one(empty):
+    assert merge_answer(empty, "300 ms") == "300 ms"
+    assert merge_answer("300 ms", empty) == "300 ms"
+
+
+def test_different_answers_are_a_conflict():
+    assert merge_answer("300 ms", " 300 MS") == "300 ms"
+    assert merge_answer("300 ms", "500 ms") == "CONFLICT"
+    assert merge_answer("CONFLICT", "300 ms") == "CONFLICT"
+    assert merge_answer("TBD", "CONFLICT") == "CONFLICT"
+
+
+def test_partial_schemas_are_merged_field_by_field():
+    first = {"BIZ_OBJ": {"Budget": {"description": "Budget", "User Answer": "10k EUR"}, "Deadline": {"description": "Date", "User Answer": "TBD"}}}
+    second = {"BIZ_OBJ": {"Deadline": {"description": "Date", "User Answer": "June"}, "Budget": {"description": "Budget", "User Answer": "20k EUR"}}}
+    third = {"SOFTWARE": {"Language": {"description": "UI language", "User Answer": "German"}}}
+    merged = merge_partials(merge_partials(first, second), third)
+    assert merged == {
+        "BIZ_OBJ": {"Budget": {"description": "Budget", "User Answer": "CONFLICT"}, "Deadline": {"description": "Date", "User Answer": "June"}},
+        "SOFTWARE": {"Language": {"description": "UI language", "User Answer": "German"}},
+    }
+    # Keys keep the order of their first appearance
+    assert list(merged) == ["BIZ_OBJ", "SOFTWARE"]
+    assert list(merged["BIZ_OBJ"]) == ["Budget", "Deadline"]
+
+
+# Observation items are the same field when everything but their "User Answer" is equal
+def test_list_items_are_matched_across_partials():
+    diameter = {"Observation Type": "2D Measurement", "Sub-Parameters": "Diameter", "User Answer": "TBD"}
+    thickness = {"Observation Type": "2D Measurement", "Sub-Parameters": "Thickness", "User Answer": "2 mm"}
+    codes = {"Observation Type": "Code Reading", "Sub-Parameters": "Code types", "User Answer": "QR"}
+    first = [diameter, thickness]
+    second = [codes, dict(diameter, **{"User Answer": "20 mm"}), dict(thickness, **{"User Answer": "TBD"})]
+    assert merge_partials(first, second) == [dict(diameter, **{"User Answer": "20 mm"}), thickness, codes]
+
+
+def test_schema_is_split_on_its_top_level_properties():
+    schema = {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "object",
+        "required": ["BIZ_OBJ", "SOFTWARE", "HARDWARE"],
+        "properties": {
+            name: {"properties": {"Field": {"description": "x" * 60, "User Answer": "TBD"}}}
+            for name in ("BIZ_OBJ", "SOFTWARE", "HARDWARE")
+        },
+    }
+    # Room for two of the three sections per batch
+    section_size = len(json.dumps(["BIZ_OBJ", schema["properties"]["BIZ_OBJ"]]))
+    batches = split_template(schema, 2 * section_size + 1)
+    assert [list(batch["properties"]) for batch in batches] == [["BIZ_OBJ", "SOFTWARE"], ["HARDWARE"]]
+    assert all(batch["$schema"] == schema["$schema"] and "required" not in batch for batch in batches)
+    assert merge_partials(*batches)["properties"] == schema["properties"]
+
+
+def test_lists_and_dicts_are_split_on_their_items():
+    items = [{"Observation Type": f"Type {index}", "User Answer": "TBD"} for index in range(5)]
+    batches = split_template(items, 100)
+    assert len(batches) > 1 and [item for batch in batches for item in batch] == items
+    fields = {f"Field {index}": {"User Answer": "TBD"} for index in range(5)}
+    batches = split_template(fields, 60)
+    assert len(batches) > 1 and {key: value for batch in batches for key, value in batch.items()} == fields
+
+
+def test_short_text_is_one_chunk():
+    assert split_text("Short text.", 100) == ["Short text."]
+
+
+def test_long_text_is_cut_at_paragraphs_with_overlap():
+    paragraphs = [f"Paragraph {index}. " + "word " * 30 for index in range(10)]
+    text = "\n\n".join(paragraphs)
+    chunks = split_text(text, 500, overlap=40)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.endswith("\n\n")
+        assert previous[-40:] == chunk[:40]
+    # Without the overlaps the chunks are the text again
+    assert chunks[0] + "".join(chunk[40:] for chunk in chunks[1:]) == text
+
+
+# Each text chunk fills what it mentions; the merged result has all answers
+def test_chunked_fill_merges_the_partial_results():
+    template = {"Budget": {"User Answer": "TBD"}, "Deadline": {"User Answer": "TBD"}}
+    text = "The budget is 10k EUR.\n\n" + "filler " * 40 + "\n\nThe deadline is June."
+
+    def fill(batch, chunk):
+        answers = {"Budget": "10k EUR" if "budget" in chunk else "TBD", "Deadline": "June" if "deadline" in chunk else "TBD"}
+        return json.dumps({key: {"User Answer": answers[key]} for key in batch})
+
+    filled = json.loads(chunked_fill(fill, template, text, max_chars=300, workers=2))
+    assert filled == {"Budget": {"User Answer": "10k EUR"}, "Deadline": {"User Answer": "June"}}
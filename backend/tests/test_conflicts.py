@@ -0,0 +1,53 @@
+import json
+import pytest
+import app
+from conflicts import find_conflicts
+from structured import parse_question_map
+
+FILLED = {
+    "MATERIAL_HANDLING": {
+        "Loading": {"description": "Description of how parts are loaded into the inspection system.", "User Answer": "CONFLICT"},
+        "Handling Speed": {"description": "Speed at which products are handled or moved.", "User Answer": "CONFLICT"},
+        "Part Size": {"description": "Size of the parts.", "User Answer": "20 mm"},
+    },
+    "SOFTWARE": {"Input/Output": {"description": "Signals to the PLC.", "User Answer": "conflict"}},
+    "Notes": ["CONFLICT"],
+}
+
+
+# Fields are keyed by their JSON Pointer, like refill.open_fields; bare values by their own pointer
+def test_conflicts_are_keyed_by_json_pointer():
+    assert list(find_conflicts(FILLED)) == [
+        "/MATERIAL_HANDLING/Loading",
+        "/MATERIAL_HANDLING/Handling Speed",
+        "/SOFTWARE/Input~1Output",
+        "/Notes/0",
+    ]
+    assert find_conflicts(FILLED)["/MATERIAL_HANDLING/Loading"] is FILLED["MATERIAL_HANDLING"]["Loading"]
+
+
+def test_conflict_questions_come_back_in_the_order_of_the_conflicts():
+    output = 'Sure: {"/b": "What is b?", "/a": "What is a?"}'
+    assert parse_question_map(output, ["/a", "/b"]) == ["What is a?", "What is b?"]
+    with pytest.raises(ValueError):
+        parse_question_map('{"/a": "What is a?"}', ["/a", "/b"])
+
+
+# Each conflict answer patches exactly the field its question was created for. "How fast do parts
+# move?" shares more words with Loading than with Handling Speed, so word matching would pick Loading.
+def test_conflict_answers_patch_the_fields_they_were_asked_for(monkeypatch):
+    def no_fill(*args):
+        raise AssertionError("short answers to conflict questions are written directly")
+
+    monkeypatch.setattr(app, "fill_fields", no_fill)
+    monkeypatch.setattr(app, "airtable_write", lambda completed_json, follow_up=False: None)
+    monkeypatch.setattr(app, "executive_summary", lambda completed_json: "Summary")
+    previous = {"MATERIAL_HANDLING": FILLED["MATERIAL_HANDLING"]}
+    questions = ["How are the parts loaded?", "How fast do parts move?"]
+
+    status, summary, filled = app.complete_questionnaire(
+        [], questions, ["By robot", "2 m/s"], "{}", "{}", True, previous_json=json.dumps(previous)
+    )
+    assert status == "complete"
+    handling = json.loads(filled)["MATERIAL_HANDLING"]
+    assert [handling[key]["User Answer"] for key in handling] == ["By robot", "2 m/s", "20 mm"]
@@ -0,0 +1,84 @@
+import json
+import os
+from export import iter_rows
+from refill import merge_templates
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(name):
+    with open(os.path.join(BACKEND, name), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def answered(field, answer):
+    return dict(field, **{"User Answer": answer})
+
+
+# Only fields with a "User Answer" become rows; the schema as shipped has none
+def test_unfilled_schema_has_no_rows():
+    assert list(iter_rows(load("overall_schema.json"))) == []
+
+
+# A filled BizObj: the section is the category and the field name the sub-category
+def test_schema_fields_take_their_category_from_the_nesting():
+    schema = load("overall_schema.json")
+    biz_obj = schema["properties"]["BIZ_OBJ"]["properties"]
+    sub_parameters = schema["properties"]["Observation"]["properties"]["ObservationSubParameters"]
+    filled = {
+        "properties": {
+            "BIZ_OBJ": {
+                "type": "object",
+                "properties": {
+                    "Problem Statement": answered(biz_obj["Problem Statement"], "Check the diameter of every ring"),
+                    # Not filled, so not exported
+                    "Current Inspection Methods": biz_obj["Current Inspection Methods"],
+                },
+            },
+            "Observation": {
+                "properties": {
+                    "ObservationSubParameters": {
+                        "oneOf": [{"properties": {"dimensionRange": answered(sub_parameters["oneOf"][0]["properties"]["dimensionRange"], ["10 mm", "40 mm"])}}]
+                    }
+                }
+            },
+        },
+        "required": ["BIZ_OBJ"],
+    }
+    assert list(iter_rows(filled)) == [
+        {
+            "Category": "BIZ_OBJ",
+            "Sub-category": "Problem Statement",
+            "Description": biz_obj["Problem Statement"]["description"],
+            "User Answer": "Check the diameter of every ring",
+        },
+        {
+            "Category": "Observation",
+            "Sub-category": "dimensionRange",
+            "Description": sub_parameters["oneOf"][0]["properties"]["dimensionRange"]["description"],
+            "User Answer": '["10 mm", "40 mm"]',
+        },
+    ]
+
+
+# Observation items carry their own category and sub-category; the BizObj fields come first
+def test_observation_items_take_their_category_from_the_item():
+    observations = load("observationsJSON.json")[:2]
+    observations[0]["User Answer"] = "20 mm"
+    bizobj = {"BIZ_OBJ": {"Budget": {"description": "Budget of the project", "User Answer": "10k EUR"}}}
+    rows = list(iter_rows(merge_templates(observations, bizobj)))
+    assert rows == [
+        {"Category": "BIZ_OBJ", "Sub-category": "Budget", "Description": "Budget of the project", "User Answer": "10k EUR"},
+        {
+            "Category": observations[0]["Observation Type"],
+            "Sub-category": observations[0]["Sub-Parameters"],
+            "Description": observations[0]["Example"],
+            "User Answer": "20 mm",
+        },
+        {
+            "Category": observations[1]["Observation Type"],
+            "Sub-category": observations[1]["Sub-Parameters"],
+            "Description": observations[1]["Example"],
+            "User Answer": "",
+        },
+    ]
@@ -0,0 +1,102 @@
+import json
+import pytest
+import app
+from pdf_extract import DocumentReadError
+from session_store import FileStore
+
+
+# An unreadable document fails before any LLM stage runs, and nothing is checkpointed for it
+def test_unreadable_document_is_not_checkpointed(tmp_path, monkeypatch):
+    def no_llm(*args, **kwargs):
+        raise AssertionError("no LLM stage may run on an unreadable document")
+
+    monkeypatch.setattr(app, "run_stages", no_llm)
+    store = FileStore(str(tmp_path))
+    with pytest.raises(DocumentReadError):
+        app.run_document_pipeline(b"this is not a PDF", store=store)
+    assert list(tmp_path.iterdir()) == []
+
+
+# Stage results are only restored for the same pipeline configuration
+def test_checkpoint_key_includes_the_stage_configuration(tmp_path, monkeypatch):
+    from benchmark import make_pdf
+
+    restored = []
+
+    def fake_stages(stages, parallel=True, results=None, on_result=None):
+        restored.append(sorted(results))
+        results = dict(results)
+        for name in stages:
+            if name not in results:
+                results[name] = []
+                on_result(name, [])
+        return results, {}
+
+    monkeypatch.setattr(app, "run_stages", fake_stages)
+    store = FileStore(str(tmp_path))
+    pdf = make_pdf(1)
+    app.run_document_pipeline(pdf, store=store)
+    app.run_document_pipeline(pdf, store=store)
+    monkeypatch.setenv("OBS_FILL_MODE", "two_pass")
+    app.run_document_pipeline(pdf, store=store)
+    monkeypatch.setenv("GROQ_MODEL_OBS_FILL", "llama-3.1-8b-instant")
+    app.run_document_pipeline(pdf, store=store)
+    stages = sorted(app.document_stages("", [], {}))
+    assert restored == [[], stages, [], []]
+
+
+# Without the local dedup the generated questions still go through the refine call
+def test_questions_are_refined_unless_deduplicated(monkeypatch):
+    calls = []
+
+    def fake_completion(stage, **kwargs):
+        calls.append(stage)
+        return f"{stage} answer"
+
+    monkeypatch.setattr(app, "chat_completion", fake_completion)
+    monkeypatch.setattr(app, "QUESTION_DEDUP", False)
+    assert app.question_create({}) == "question_refine answer"
+    monkeypatch.setattr(app, "QUESTION_DEDUP", True)
+    assert app.question_create({}) == "question_create answer"
+    assert calls == ["question_create", "question_refine", "question_create"]
+
+
+# Text sent after the questionnaire fills the open fields of the completed JSON; the rows of
+# the first export are only written to Airtable again when the export upserts
+def test_additional_text_fills_the_completed_json(tmp_path, monkeypatch):
+    def no_full_refill(*args):
+        raise AssertionError("the completed JSON has an open field, so no full refill may run")
+
+    class FakeWriter:
+        def __init__(self, **kwargs):
+            written.append(kwargs["upsert_fields"])
+
+        def write(self, rows):
+            return {"written": len(rows), "failed": []}
+
+    written = []
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "fill_fields", lambda question, answer, fields: {pointer: "10k EUR" for pointer in fields})
+    monkeypatch.setattr(app, "answer_refill", no_full_refill)
+    monkeypatch.setattr(app, "executive_summary", lambda completed_json: "Summary")
+    monkeypatch.setattr(app, "AirtableWriter", FakeWriter)
+    completed = {
+        "BIZ_OBJ": {
+            "Budget": {"description": "Budget of the project", "User Answer": "TBD"},
+            "Deadline": {"description": "Delivery date", "User Answer": "June"},
+        }
+    }
+    question = ["Is there any additional information about the requirements?"]
+
+    monkeypatch.delenv("AIRTABLE_UPSERT_FIELDS", raising=False)
+    status, summary, filled = app.complete_questionnaire(question, [], ["The budget is 10k EUR"], "{}", "{}", False, base_json=json.dumps(completed))
+    assert (status, summary) == ("complete", "Summary")
+    assert json.loads(filled)["BIZ_OBJ"] == {
+        "Budget": {"description": "Budget of the project", "User Answer": "10k EUR"},
+        "Deadline": {"description": "Delivery date", "User Answer": "June"},
+    }
+    assert written == []
+
+    monkeypatch.setenv("AIRTABLE_UPSERT_FIELDS", "Category,Sub-category")
+    app.complete_questionnaire(question, [], ["The budget is 10k EUR"], "{}", "{}", False, base_json=json.dumps(completed))
+    assert written == [["Category", "Sub-category"]]
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from refill import plan_refill, open_fields, SpeculativeRefill
+
+DATA = {
+    "MATERIAL_HANDLING": {
+        "Loading": {"description": "Description of how parts are loaded into the inspection system.", "User Answer": "TBD"},
+        "Handling Speed": {"description": "Speed at which products are handled or moved.", "User Answer": "TBD"},
+    },
+    "SOFTWARE": {
+        "Cycle Time": {"description": "Required cycle time per part.", "User Answer": "TBD"},
+        "Language Preference": {"description": "Language of the user interface.", "User Answer": "TBD"},
+    },
+}
+
+
+def test_short_answer_to_a_clear_question_is_written_directly():
+    filled, jobs = plan_refill([("What is the cycle time?", "300 ms")], open_fields(DATA))
+    assert filled == {"/SOFTWARE/Cycle Time": ["300 ms"]}
+    assert jobs == []
+
+
+# "parts" and "how" match the Loading description, but the question is not about loading
+def test_weak_match_goes_through_the_fill():
+    filled, jobs = plan_refill([("How fast do parts move?", "2 m/s")], open_fields(DATA))
+    assert filled == {}
+    assert [(question, answer, list(fields)) for question, answer, fields in jobs] == [
+        ("How fast do parts move?", "2 m/s", ["/MATERIAL_HANDLING/Loading"])
+    ]
+
+
+def test_unmatched_answer_is_filled_against_all_open_fields():
+    filled, jobs = plan_refill([("Anything else?", "Cleanroom, class 7")], open_fields(DATA))
+    assert filled == {}
+    assert len(jobs[0][2]) == 4
+
+
+# A job queued behind another session's job is run inline instead of waiting for the pool
+def test_queued_speculative_job_runs_inline():
+    release = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        executor.submit(release.wait)
+        speculation = SpeculativeRefill(lambda question, answer, fields: {pointer: answer for pointer in fields}, executor)
+        assert speculation.update(["How fast do parts move?"], ["2 m/s"], DATA) == 1
+        assert speculation.fill("How fast do parts move?", "2 m/s", dict(open_fields(DATA)[:1])) == {"/MATERIAL_HANDLING/Loading": "2 m/s"}
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+# A conflict question fills the field it was asked for, even when its words match another field
+def test_targeted_question_fills_its_field():
+    data = {"MATERIAL_HANDLING": {key: dict(field, **{"User Answer": "CONFLICT"}) for key, field in DATA["MATERIAL_HANDLING"].items()}}
+    filled, jobs = plan_refill([("How fast do parts move?", "2 m/s")], open_fields(data, ("CONFLICT",)), ["/MATERIAL_HANDLING/Handling Speed"])
+    assert filled == {"/MATERIAL_HANDLING/Handling Speed": ["2 m/s"]}
+    assert jobs == []
@@ -0,0 +1,76 @@
+import json
+import threading
+import pytest
+import app
+
+FILLED = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "properties": {
+        "BIZ_OBJ": {"Budget": {"description": "Budget of the project", "User Answer": "10k EUR"}},
+        "HARDWARE": {},
+        "SOFTWARE": {"Language": {"description": "UI language", "User Answer": "German"}},
+    },
+    "required": ["BIZ_OBJ", "SOFTWARE"],
+    "Observations": [{"Observation Type": "2D Measurement", "User Answer": "20 mm"}],
+}
+
+
+# Schema sections first, then the keys next to "properties"; empty sections and schema keys are left out
+def test_sections_follow_the_schema_order():
+    sections = app.summary_sections(json.dumps(FILLED))
+    assert [name for name, _ in sections] == ["BIZ_OBJ", "SOFTWARE", "Observations"]
+    assert sections[0][1] == FILLED["properties"]["BIZ_OBJ"]
+
+
+def test_a_single_section_is_summarized_in_one_call(monkeypatch):
+    calls = []
+
+    def fake_stream(stage, messages, **kwargs):
+        calls.append(stage)
+        return iter(["Summary"])
+
+    monkeypatch.setattr(app, "stream_completion", fake_stream)
+    single = {"properties": {"BIZ_OBJ": FILLED["properties"]["BIZ_OBJ"], "HARDWARE": {}}}
+    assert app.summary_sections(single) is None
+    assert app.summary_sections("not JSON") is None
+    assert "".join(app.executive_summary_stream(json.dumps(single))) == "Summary"
+    assert "".join(app.executive_summary_stream(json.dumps(FILLED), mode="single")) == "Summary"
+    assert calls == ["executive_summary", "executive_summary"]
+
+
+# The sections are summarized concurrently but shown in schema order: BIZ_OBJ only finishes
+# after the last section has started
+def test_sections_are_streamed_in_schema_order(monkeypatch):
+    last_started = threading.Event()
+
+    def fake_section_stream(name, section):
+        if name == "Observations":
+            last_started.set()
+        elif name == "BIZ_OBJ":
+            assert last_started.wait(timeout=5)
+        return iter([f"{name} part 1. ", f"{name} part 2."])
+
+    monkeypatch.setattr(app, "summary_section_stream", fake_section_stream)
+    summary = "".join(app.sectioned_summary_stream(app.summary_sections(FILLED)))
+    assert summary == (
+        "# Executive Summary\n\n"
+        "## BIZ_OBJ\n\nBIZ_OBJ part 1. BIZ_OBJ part 2.\n\n"
+        "## SOFTWARE\n\nSOFTWARE part 1. SOFTWARE part 2.\n\n"
+        "## Observations\n\nObservations part 1. Observations part 2.\n\n"
+    )
+
+
+def test_a_failing_section_raises_in_the_stream(monkeypatch):
+    def fake_section_stream(name, section):
+        if name == "SOFTWARE":
+            raise TimeoutError("executive_summary_section timed out")
+        return iter([f"{name} summary."])
+
+    monkeypatch.setattr(app, "summary_section_stream", fake_section_stream)
+    stream = app.sectioned_summary_stream(app.summary_sections(FILLED))
+    shown = []
+    with pytest.raises(TimeoutError):
+        for piece in stream:
+            shown.append(piece)
+    assert "".join(shown) == "# Executive Summary\n\n## BIZ_OBJ\n\nBIZ_OBJ summary.\n\n## SOFTWARE\n\n"
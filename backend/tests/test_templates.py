@@ -0,0 +1,15 @@
+from templates import classification_choices, observations_for
+
+
+def test_choices_are_matched_exactly():
+    answer = 'The document asks for text reading: ["OCR", "Code Reading"]. No other classification applies.'
+    assert classification_choices(answer) == ["OCR", "Code Reading"]
+
+
+def test_choices_keep_prompt_order():
+    assert classification_choices('["color verification", "2D Measurement"]') == ["2D Measurement", "Color Verification"]
+
+
+def test_answer_without_label_array_names_no_choice():
+    assert classification_choices("Classification and OCR") == []
+    assert observations_for("Classification and OCR") == []
@@ -0,0 +1,32 @@
+import hashlib
+import sys
+import types
+import pytest
+import tokens
+
+
+@pytest.fixture
+def fresh_encoder(monkeypatch):
+    monkeypatch.setattr(tokens, "_encoder", None)
+    monkeypatch.delenv("TOKENIZER_PATH", raising=False)
+
+
+# Without a cached encoding nothing is downloaded; tokens are estimated from characters
+def test_uncached_encoding_is_not_downloaded(fresh_encoder, monkeypatch, tmp_path):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=lambda name: pytest.fail("downloaded")))
+    assert tokens.count_tokens("x" * 10) == 3
+
+
+def test_cached_encoding_is_used(fresh_encoder, monkeypatch, tmp_path):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    (tmp_path / hashlib.sha1(tokens.TIKTOKEN_URLS["cl100k_base"].encode()).hexdigest()).write_bytes(b"")
+    encoding = types.SimpleNamespace(encode=lambda text, disallowed_special: text.split())
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=lambda name: encoding))
+    assert tokens.count_tokens("one two three") == 3
+
+
+def test_fit_max_tokens():
+    assert tokens.fit_max_tokens("llama-3.1-70b-versatile", 1000, 8000, expected_tokens=400) == 500
+    with pytest.raises(tokens.PromptTooLongError):
+        tokens.fit_max_tokens("unknown-model", tokens.DEFAULT_CONTEXT_WINDOW, 8000)
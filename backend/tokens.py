@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import defaultdict
+import telemetry
+
+# Token accounting for LLM calls: prompts are counted locally before they are sent, max_tokens is
+# sized from the expected output, prompts that do not fit the model's context window are refused
+# (chunked fills split them instead) and every session has a running token budget.
+
+# Context window per model in tokens; other models use LLM_CONTEXT_WINDOW
+CONTEXT_WINDOWS = {
+    "llama-3.1-70b-versatile": 131072,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+}
+CONTEXT_WINDOWS.update({model: int(size) for model, size in json.loads(os.getenv("LLM_CONTEXT_WINDOWS", "{}")).items()})
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", 8192))
+# Every call may produce at least this many tokens
+MIN_OUTPUT_TOKENS = 256
+# Headroom on top of the expected output size
+OUTPUT_MARGIN = 1.25
+# Expected tokens per filled "User Answer" and per generated question
+ANSWER_TOKENS = 40
+QUESTION_TOKENS = 40
+# Chat formatting tokens added per message and per request
+MESSAGE_OVERHEAD = 4
+REQUEST_OVERHEAD = 3
+# Tokens (prompt + completion) a session may use; 0 means unlimited
+SESSION_BUDGET = int(os.getenv("LLM_SESSION_TOKEN_BUDGET", 0))
+
+
+class TokenLimitError(ValueError):
+    pass
+
+
+class PromptTooLongError(TokenLimitError):
+    pass
+
+
+class TokenBudgetExceeded(TokenLimitError):
+    pass
+
+
+# Where tiktoken downloads its encodings from; they are only used when already in tiktoken's cache
+TIKTOKEN_URLS = {
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+}
+
+_encoder = None
+_spent = defaultdict(int)
+_spent_lock = threading.Lock()
+
+
+def _estimate(text):
+    return -(-len(text) // telemetry.CHARS_PER_TOKEN)
+
+
+# True when tiktoken can load the encoding from its local cache (TIKTOKEN_CACHE_DIR,
+# DATA_GYM_CACHE_DIR or the temp directory) instead of downloading it
+def tiktoken_cached(name):
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["TIKTOKEN_CACHE_DIR"]
+    else:
+        cache_dir = os.getenv("DATA_GYM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "data-gym-cache"))
+    url = TIKTOKEN_URLS.get(name)
+    return bool(cache_dir) and url is not None and os.path.exists(os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest()))
+
+
+# The local tokenizer: the model's tokenizer.json at TOKENIZER_PATH (needs the tokenizers package),
+# otherwise tiktoken's cl100k_base, which is close to the Llama 3 vocabulary, if it is cached locally.
+# Nothing is downloaded, so the app also works offline; without a tokenizer tokens are estimated
+# from the text length.
+def _load_encoder():
+    path = os.getenv("TOKENIZER_PATH")
+    name = os.getenv("TIKTOKEN_ENCODING", "cl100k_base")
+    try:
+        if path:
+            from tokenizers import Tokenizer
+
+            tokenizer = Tokenizer.from_file(path)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        if not tiktoken_cached(name):
+            print(f"The tiktoken encoding {name} is not cached locally (TIKTOKEN_CACHE_DIR), estimating tokens from characters")
+            return _estimate
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(name)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        print(f"No local tokenizer available, estimating tokens from characters: {e}")
+        return _estimate
+
+
+# The encoder is loaded on first use without a lock; threads racing on the first call
+# each load it once and keep the same result
+def count_tokens(text):
+    global _encoder
+    if _encoder is None:
+        _encoder = _load_encoder()
+    return _encoder(text)
+
+
+def count_messages(messages):
+    return REQUEST_OVERHEAD + sum(MESSAGE_OVERHEAD + count_tokens(message["content"]) for message in messages)
+
+
+def context_window(model):
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def _count_fields(data):
+    if isinstance(data, dict):
+        own = 1 if "User Answer" in data or "description" in data else 0
+        return own + sum(_count_fields(value) for value in data.values())
+    if isinstance(data, list):
+        return sum(_count_fields(item) for item in data)
+    return 0
+
+
+# Expected size of a template returned with its "User Answer" fields filled
+def filled_template_tokens(template):
+    if isinstance(template, str):
+        try:
+            template = json.loads(template)
+        except json.JSONDecodeError:
+            return count_tokens(template)
+    return count_tokens(json.dumps(template, ensure_ascii=False, separators=(",", ":"))) + ANSWER_TOKENS * _count_fields(template)
+
+
+# Expected size of the questions for a filled JSON: one question per open field
+def question_tokens(json_template, markers=("TBD", "CONFLICT")):
+    text = str(json_template)
+    return QUESTION_TOKENS * sum(text.count(marker) for marker in markers)
+
+
+# max_tokens for a call: the expected output plus a margin, within the stage's cap and
+# the room the prompt leaves in the context window. Raises PromptTooLongError if there is no room.
+def fit_max_tokens(model, prompt_tokens, max_tokens, expected_tokens=None):
+    if expected_tokens is not None:
+        max_tokens = min(max_tokens, max(MIN_OUTPUT_TOKENS, int(expected_tokens * OUTPUT_MARGIN)))
+    available = context_window(model) - prompt_tokens
+    if available < min(max_tokens, MIN_OUTPUT_TOKENS):
+        raise PromptTooLongError(
+            f"The prompt has {prompt_tokens} tokens, which leaves no room for the answer in the {context_window(model)}-token context of {model}"
+        )
+    return min(max_tokens, available)
+
+
+# Refuse a call whose prompt would take the current session over its budget
+def check_budget(prompt_tokens, session_id=None):
+    if not SESSION_BUDGET:
+        return
+    session_id = session_id or telemetry.current_session()
+    with _spent_lock:
+        spent = _spent[session_id]
+    if spent + prompt_tokens > SESSION_BUDGET:
+        raise TokenBudgetExceeded(f"Session {session_id} has used {spent} of its {SESSION_BUDGET} tokens; this call needs {prompt_tokens} more")
+
+
+def spend(tokens, session_id=None):
+    session_id = session_id or telemetry.current_session()
+    with _spent_lock:
+        _spent[session_id] += tokens
+
+
+def session_usage(session_id=None):
+    session_id = session_id or telemetry.current_session()
+    with _spent_lock:
+        spent = _spent[session_id]
+    return {"spent": spent, "budget": SESSION_BUDGET or None, "remaining": SESSION_BUDGET - spent if SESSION_BUDGET else None}
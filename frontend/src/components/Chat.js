@@ -68,6 +68,8 @@ const Chat = () => {
   const inputRef = useRef(null);
   const fileInputRef = useRef(null);
   const chatBoxRef = useRef(null);
+  // Session id issued by /api/process_document; sent with every request so users do not share state
+  const sessionIdRef = useRef(null);
 
   useEffect(() => {
     if (chatBoxRef.current) {
@@ -104,7 +106,7 @@ const Chat = () => {
     try {
       const response = await fetch('http://127.0.0.1:5000/api/show_question', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'X-Session-ID': sessionIdRef.current },
         body: JSON.stringify({
           answer,
           all_answers: answers
@@ -172,6 +174,7 @@ const Chat = () => {
         throw new Error(data.error);
       }
 
+      sessionIdRef.current = data.session_id;
       setIsPdfUploaded(true);
       setSelectedFile(file);
       
@@ -237,7 +240,7 @@ const Chat = () => {
       } else {
         const response = await fetch('http://127.0.0.1:5000/api/process_additional_text', {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: { 'Content-Type': 'application/json', 'X-Session-ID': sessionIdRef.current },
           body: JSON.stringify({ text: content })
         });
 
@@ -289,6 +292,7 @@ const Chat = () => {
     setAnswers([]);
     setIsQuestionnaire(false);
     setIsPdfUploaded(false);
+    sessionIdRef.current = null;
   }, []);
 
 //UPDATE-6